@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import fire
+import platform
+import matplotlib
+import numpy as np
+import neurokit2 as nk
+
+from typing import Callable, Dict, List
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, ".."))
+
+from core.visualizer import Visualizer
+from core.txt_generator import TextGenerator
+from core.vis_generator import VISUALIZATIONS
+from core.token_utils import count_txt_tokens
+import core.registry as registry
+from core.registry import dependency_cache
+
+# window shapes of the datasets in data_utils/preprocess.py
+DATASETS = {
+    "WESAD": {
+        "modality": "RSP",
+        "sampling_rate": 700,
+        "txt_sampling_rate": 30,
+        "win_len": 21000,
+        "channels": ["Chest respiration"],
+    },
+    "sEMG_HG": {
+        "modality": "EMG",
+        "sampling_rate": 2000,
+        "txt_sampling_rate": 10,
+        "win_len": 400,
+        "channels": ["EMG1", "EMG2", "EMG3", "EMG4"],
+    },
+    "PTB-XL": {
+        "modality": "ECG",
+        "sampling_rate": 100,
+        "txt_sampling_rate": 100,
+        "win_len": 1000,
+        "channels": ["lead II"],
+    },
+    "HHAR": {
+        "modality": "ACC",
+        "sampling_rate": 100,
+        "txt_sampling_rate": 10,
+        "win_len": 500,
+        "channels": ["X-axis", "Y-axis", "Z-axis"],
+    },
+    "Swimming": {
+        "modality": "ACC",
+        "sampling_rate": 30,
+        "txt_sampling_rate": 10,
+        "win_len": 180,
+        "channels": ["X-axis", "Y-axis", "Z-axis"],
+    },
+    "UTD-MHAD": {
+        "modality": "ACC",
+        "sampling_rate": 50,
+        "txt_sampling_rate": 10,
+        "win_len": 150,
+        "channels": ["X-axis", "Y-axis", "Z-axis"],
+    },
+}
+
+# visualizations with a plot renderer but not offered to the planner
+EXTRA_VISUALIZATIONS = [
+    vis.name for vis in registry.entries() if vis.plot is not None and not vis.listed
+]
+
+MODALITIES = ["ECG", "EMG", "RSP", "EDA", "PPG", "EOG"]
+
+# styles handled by TextGenerator.gen_txt, the others fall back to raw waveform
+TXT_STYLES = [
+    "raw waveform",
+    "signal power spectrum density",
+    "ECG signal and peaks",
+    "ECG heart rate",
+    "ECG individual heart beats",
+    "EMG signal",
+    "EMG muscle activation",
+]
+
+# compact text styles without a visualization counterpart
+TXT_ONLY_STYLES = [
+    vis.name for vis in registry.entries() if vis.plot is None and vis.txt is not None
+]
+
+
+def gen_window(dataset: str, seed: int = 0) -> np.array:
+    """Synthetic z-normalized window matching the dataset's shape"""
+    spec = DATASETS[dataset]
+    sr = spec["sampling_rate"]
+    win_len = spec["win_len"]
+    duration = win_len / sr
+    if duration.is_integer():
+        duration = int(duration)
+    rng = np.random.default_rng(seed)
+
+    if spec["modality"] == "ECG":
+        window = nk.ecg_simulate(duration=duration, sampling_rate=sr, random_state=seed)
+        window = window[:win_len, None]
+    elif spec["modality"] == "RSP":
+        window = nk.rsp_simulate(duration=duration, sampling_rate=sr, random_state=seed)
+        window = window[:win_len, None]
+    elif spec["modality"] == "EMG":
+        window = np.stack(
+            [
+                nk.emg_simulate(
+                    duration=duration,
+                    sampling_rate=sr,
+                    burst_number=1,
+                    burst_duration=duration / 2,
+                    random_state=seed + i,
+                )[:win_len]
+                for i in range(len(spec["channels"]))
+            ],
+            axis=1,
+        )
+    else:
+        t = np.arange(win_len) / sr
+        freqs = rng.uniform(0.5, 3, len(spec["channels"]))
+        window = np.sin(2 * np.pi * t[:, None] * freqs[None, :])
+        window += 0.3 * rng.standard_normal((win_len, len(spec["channels"])))
+
+    return (window - window.mean(axis=0)) / window.std(axis=0)
+
+
+def vis_args(func: str, data: np.array) -> Dict:
+    if func == "raw waveform":
+        return {"ylim": (data.min(), data.max())}
+    if func == "spectrogram":
+        nperseg = min(128, len(data) // 4)
+        return {
+            "nfft": nperseg,
+            "nperseg": nperseg,
+            "noverlap": nperseg // 2,
+            "mode": "magnitude",
+        }
+    return {}
+
+
+def processing_step(func: str, sr: int, args: Dict) -> Callable:
+    """Signal processing that the visualization runs before drawing"""
+    if func == "spectrogram":
+        vs = Visualizer(["x"], sr, func, args)
+        vs.close()
+        return lambda data: vs.spectrogram(data, **args)
+    if func == "signal power spectrum density":
+        return lambda data: [
+            nk.signal_psd(data[:, i], sampling_rate=sr, method="fft")
+            for i in range(data.shape[1])
+        ]
+    vis = registry.get(func)
+    if vis is not None and vis.needs is not None:
+        return lambda data: registry.DEPENDENCIES[vis.needs](data, sr)
+    return lambda data: None
+
+
+def timeit(fn: Callable, repeats: int) -> List[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def draw_uncached(vs: Visualizer, data: np.array) -> None:
+    dependency_cache.clear()
+    vs.draw(data)
+
+
+def gen_txt_uncached(tg: TextGenerator, data: np.array) -> str:
+    dependency_cache.clear()
+    return tg.gen_txt(data)
+
+
+def summarize(times: List[float]) -> Dict:
+    return {
+        "median_ms": float(np.median(times)),
+        "mean_ms": float(np.mean(times)),
+        "min_ms": float(np.min(times)),
+    }
+
+
+def bench_vis(dataset: str, func: str, data: np.array, repeats: int) -> Dict:
+    spec = DATASETS[dataset]
+    args = vis_args(func, data)
+    process = processing_step(func, spec["sampling_rate"], args)
+    vs = Visualizer(spec["channels"], spec["sampling_rate"], func, args)
+    try:
+        vs.gen_b64_img(data)  # warm-up
+        processing = timeit(lambda: process(data), repeats)
+        # the cache is cleared so that every draw runs its processing
+        drawing = timeit(lambda: draw_uncached(vs, data), repeats)
+        encoding = timeit(vs.encode, repeats)
+    finally:
+        vs.close()
+
+    # drawing includes the processing the plot functions run internally
+    drawing = [max(d - p, 0.0) for d, p in zip(drawing, processing)]
+    total = [p + d + e for p, d, e in zip(processing, drawing, encoding)]
+    return {
+        "processing": summarize(processing),
+        "drawing": summarize(drawing),
+        "encoding": summarize(encoding),
+        "total": summarize(total),
+    }
+
+
+def bench_txt(
+    dataset: str, style: str, data: np.array, repeats: int, llm_version: str
+) -> Dict:
+    spec = DATASETS[dataset]
+    tg = TextGenerator(
+        spec["channels"], spec["sampling_rate"], style, 2, spec["txt_sampling_rate"]
+    )
+    if style in TXT_STYLES + TXT_ONLY_STYLES:
+        process = processing_step(style, spec["sampling_rate"], {})
+    else:
+        process = processing_step("raw waveform", spec["sampling_rate"], {})
+    txt = tg.gen_txt(data)  # warm-up
+    processing = timeit(lambda: process(data), repeats)
+    generation = timeit(lambda: gen_txt_uncached(tg, data), repeats)
+
+    # serialization is what remains after the processing of the style
+    serialization = [max(g - p, 0.0) for g, p in zip(generation, processing)]
+    record = {
+        "processing": summarize(processing),
+        "serialization": summarize(serialization),
+        "total": summarize(generation),
+        "num_chars": len(txt),
+    }
+    # the tiktoken encoder is downloaded on first use, without it only the
+    # token count is missing
+    try:
+        record["num_tokens"] = count_txt_tokens(txt, llm_version)
+    except Exception as e:
+        record["tokens_error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def applicable(func: str, dataset: str) -> bool:
+    modality = [m for m in MODALITIES if func.startswith(m)]
+    return not modality or modality[0] == DATASETS[dataset]["modality"]
+
+
+def fmt_total(record: Dict) -> str:
+    if "error" in record:
+        return record["error"]
+    return f"{record['total']['median_ms']:.1f} ms"
+
+
+def split_arg(arg) -> List[str]:
+    # fire parses comma-separated values into tuples
+    if arg is None:
+        return []
+    if isinstance(arg, str):
+        return arg.split(",")
+    return list(arg)
+
+
+def run(
+    out: str = "render_bench.json",
+    repeats: int = 5,
+    datasets: str = None,
+    funcs: str = None,
+    txt: bool = True,
+    llm_version: str = "gpt-4o",
+) -> None:
+    """Time every visualization (and text style) on synthetic windows"""
+    datasets = split_arg(datasets) or list(DATASETS.keys())
+    all_funcs = split_arg(funcs) or list(VISUALIZATIONS.keys()) + EXTRA_VISUALIZATIONS
+    if txt and not funcs:
+        all_funcs += TXT_ONLY_STYLES
+
+    results = []
+    covered = set()
+    for dataset in datasets:
+        data = gen_window(dataset)
+        for func in all_funcs:
+            if not applicable(func, dataset):
+                continue
+            covered.add(func)
+            record = {"dataset": dataset, "func": func, "shape": list(data.shape)}
+            if func not in TXT_ONLY_STYLES:
+                try:
+                    record["vis"] = bench_vis(dataset, func, data, repeats)
+                except Exception as e:
+                    record["vis"] = {"error": f"{type(e).__name__}: {e}"}
+            if txt:
+                try:
+                    record["txt"] = bench_txt(dataset, func, data, repeats, llm_version)
+                except Exception as e:
+                    record["txt"] = {"error": f"{type(e).__name__}: {e}"}
+            results.append(record)
+            print(
+                f"{dataset:10s} {func:40s} "
+                + " ".join(
+                    f"{kind}: {fmt_total(record[kind])}"
+                    for kind in ["vis", "txt"]
+                    if kind in record
+                )
+            )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "matplotlib": matplotlib.__version__,
+        "backend": matplotlib.get_backend(),
+        "neurokit2": nk.__version__,
+        "repeats": repeats,
+        "results": results,
+        "skipped": sorted(set(all_funcs) - covered),
+    }
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results stored in {out}")
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
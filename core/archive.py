@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import zlib
+import base64
+import sqlite3
+import hashlib
+import threading
+
+from typing import Dict, Iterator, Tuple
+
+ARCHIVE_NAME = "archive.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY, codec TEXT, size INTEGER, data BLOB
+);
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY, sha256 TEXT, created REAL
+);
+CREATE TABLE IF NOT EXISTS chats (
+    filename TEXT PRIMARY KEY,
+    prompt_sha256 TEXT,
+    answer TEXT,
+    tokens TEXT,
+    num_tokens INTEGER,
+    cost TEXT,
+    latency REAL,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    kind TEXT, pid INTEGER, created REAL, payload TEXT
+);
+"""
+
+
+def compress(data: bytes) -> Tuple[str, bytes]:
+    # PNGs are already compressed, keep them as they are
+    compressed = zlib.compress(data)
+    if len(compressed) < 0.9 * len(data):
+        return "zlib", compressed
+    return "raw", data
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return bytes(data)
+
+
+class ArchiveSink:
+    """
+    Stores logs in a single SQLite file under log_dir. Contents are kept once per
+    sha256 in the blobs table, so example images repeated across samples are
+    stored once. Each process opens its own connection.
+    """
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, ARCHIVE_NAME)
+        os.makedirs(log_dir, exist_ok=True)
+        self.pid = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.connect()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(pid=None, conn=None, lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def put_blob(self, data: bytes) -> str:
+        sha256 = hashlib.sha256(data).hexdigest()
+        exists = self.conn.execute(
+            "SELECT 1 FROM blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        if exists is None:
+            codec, stored = compress(data)
+            self.conn.execute(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)",
+                (sha256, codec, len(data), stored),
+            )
+        return sha256
+
+    def write(self, filename, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        self.connect()
+        with self.lock:
+            sha256 = self.put_blob(content)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (filename, sha256, time.time()),
+            )
+
+    def store_chat(self, filename, prompt, answer, num_tokens, latency=None):
+        cost = num_tokens.to_dict() if hasattr(num_tokens, "to_dict") else None
+        self.connect()
+        with self.lock:
+            prompt_sha256 = self.put_blob(str(prompt).encode("utf-8"))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    filename,
+                    prompt_sha256,
+                    answer,
+                    str(num_tokens),
+                    None if num_tokens is None else int(num_tokens),
+                    None if cost is None else json.dumps(cost),
+                    latency,
+                    time.time(),
+                ),
+            )
+
+    def store_img(self, filename, img):
+        if isinstance(img, str):
+            img = base64.b64decode(img)
+        self.write(filename, img)
+
+    def store(self, filename, content):
+        self.write(filename, content)
+
+    def store_event(self, kind, payload, pid):
+        self.connect()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO events VALUES (?, ?, ?, ?)",
+                (kind, pid, time.time(), json.dumps(payload)),
+            )
+
+    def events(self, kind):
+        self.connect()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT payload FROM events WHERE kind = ? ORDER BY pid, rowid",
+                (kind,),
+            ).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def flush(self):
+        if self.pid == os.getpid():
+            with self.lock:
+                self.conn.commit()
+
+    def close(self):
+        if self.pid == os.getpid():
+            self.flush()
+            self.conn.close()
+            self.pid = None
+            self.conn = None
+
+
+class ArchiveReader:
+    """Read access to an archive written by ArchiveSink"""
+
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, ARCHIVE_NAME)
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def blob(self, sha256: str) -> bytes:
+        codec, data = self.conn.execute(
+            "SELECT codec, data FROM blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+        return decompress(codec, data)
+
+    def files(self, prefix: str = "") -> Iterator[Tuple[str, bytes]]:
+        rows = self.conn.execute(
+            "SELECT filename, sha256 FROM files"
+            " WHERE substr(filename, 1, ?) = ? ORDER BY filename",
+            (len(prefix), prefix),
+        ).fetchall()
+        for filename, sha256 in rows:
+            yield filename, self.blob(sha256)
+
+    def chats(self, prefix: str = "") -> Iterator[Dict]:
+        rows = self.conn.execute(
+            "SELECT filename, prompt_sha256, answer, tokens, num_tokens, cost, latency,"
+            " created FROM chats WHERE substr(filename, 1, ?) = ? ORDER BY filename",
+            (len(prefix), prefix),
+        ).fetchall()
+        for row in rows:
+            filename, prompt_sha256, answer, tokens, num_tokens, cost = row[:6]
+            yield {
+                "filename": filename,
+                "prompt": self.blob(prompt_sha256).decode("utf-8"),
+                "answer": answer,
+                "tokens": tokens,
+                "num_tokens": num_tokens,
+                "cost": None if cost is None else json.loads(cost),
+                "latency": row[6],
+                "created": row[7],
+            }
+
+    def events(self) -> Iterator[Tuple[str, int, Dict]]:
+        rows = self.conn.execute(
+            "SELECT kind, pid, payload FROM events ORDER BY pid, rowid"
+        ).fetchall()
+        for kind, pid, payload in rows:
+            yield kind, pid, json.loads(payload)
+
+    def samples(self):
+        """Sample directories under prompts/, as in the file layout"""
+        rows = self.conn.execute(
+            "SELECT filename FROM files UNION SELECT filename FROM chats"
+        ).fetchall()
+        samples = set()
+        for (filename,) in rows:
+            parts = filename.split("/")
+            if parts[0] == "prompts" and len(parts) > 2:
+                samples.add("/".join(parts[:2]))
+        return sorted(samples)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,118 @@
+import numpy as np
+import scipy.signal
+
+from functools import lru_cache
+from typing import Dict, List
+
+# neurokit's envelope filters assume 1000 Hz whatever the sampling rate
+ENVELOPE_SR = 1000
+
+
+@lru_cache(maxsize=None)
+def emg_filters(sr: float) -> Dict:
+    """The filters of nk.emg_process, designed once per sampling rate"""
+    return {
+        # nk.emg_clean (biosppy): 4th order 100 Hz highpass
+        "clean": scipy.signal.butter(4, 2 * 100 / sr, btype="highpass"),
+        # nk.emg_amplitude: 10-400 Hz bandpass, and 8 Hz lowpass of the envelope
+        "band": scipy.signal.butter(
+            2, [10, 400], btype="bandpass", output="sos", fs=ENVELOPE_SR
+        ),
+        "envelope": scipy.signal.butter(
+            2, 8, btype="lowpass", output="sos", fs=ENVELOPE_SR
+        ),
+    }
+
+
+def emg_clean(windows: np.array, sr: float) -> np.array:
+    """Highpass filtered and centered (..., T, C) windows"""
+    b, a = emg_filters(sr)["clean"]
+    filtered = scipy.signal.filtfilt(b, a, windows, axis=-2)
+    return filtered - filtered.mean(axis=-2, keepdims=True)
+
+
+def emg_amplitude(cleaned: np.array, sr: float) -> np.array:
+    """Linear envelope of the Teager-Kaiser energy of (..., T, C) cleaned windows"""
+    filters = emg_filters(sr)
+    tkeo = cleaned.copy()
+    tkeo[..., 1:-1, :] = (
+        cleaned[..., 1:-1, :] ** 2 - cleaned[..., :-2, :] * cleaned[..., 2:, :]
+    )
+    tkeo[..., 0, :] = tkeo[..., 1, :]
+    tkeo[..., -1, :] = tkeo[..., -2, :]
+    filtered = scipy.signal.sosfiltfilt(filters["band"], tkeo, axis=-2)
+    return scipy.signal.sosfiltfilt(filters["envelope"], np.abs(filtered), axis=-2)
+
+
+def emg_activation(amplitude: np.array, sr: float) -> Dict[str, np.array]:
+    """
+    Activity, onsets and offsets of (..., T, C) amplitudes with the threshold
+    method of nk.emg_activation: runs above a tenth of the standard deviation
+    that last and follow a baseline of at least 50 ms
+    """
+    length = amplitude.shape[-2]
+    # one row per channel of each window
+    rows = np.moveaxis(amplitude, -2, -1).reshape(-1, length)
+    threshold = rows.std(axis=1) / 10
+    if np.any(threshold > rows.max(axis=1)):
+        raise ValueError(
+            "NeuroKit error: emg_activation(): the threshold specified exceeds the maximum of the signalamplitude."
+        )
+    binary = (rows > threshold[:, None]).ravel()
+    duration_min = int(0.05 * sr)
+
+    # runs of equal values, each row starting a new run
+    is_start = np.ones(len(binary), dtype=bool)
+    is_start[1:] = binary[1:] != binary[:-1]
+    is_start[::length] = True
+    starts = np.flatnonzero(is_start)
+    durations = np.diff(np.append(starts, len(binary)))
+    local = starts % length
+
+    # active runs preceded by a baseline run in the same row, both long enough
+    preceded = np.zeros(len(starts), dtype=bool)
+    preceded[1:] = (local[1:] > 0) & (durations[:-1] >= duration_min)
+    valid = binary[starts] & (durations >= duration_min) & preceded
+    onsets = starts[valid]
+    offsets = onsets + durations[valid]
+    # offsets at the end of a row are dropped, and so is the activity of their onset
+    closed = offsets % length != 0
+
+    activity = np.zeros(len(binary) + 1)
+    np.add.at(activity, onsets[closed], 1)
+    np.add.at(activity, offsets[closed], -1)
+    activity = np.cumsum(activity[:-1])
+    marks = {
+        "EMG_Activity": activity,
+        "EMG_Onsets": onsets,
+        "EMG_Offsets": offsets[closed],
+    }
+
+    columns = {}
+    for name, values in marks.items():
+        if name != "EMG_Activity":
+            values = np.bincount(values, minlength=len(binary)).astype(float)
+        values = values.reshape(-1, amplitude.shape[-1], length)
+        columns[name] = np.moveaxis(values, -1, -2).reshape(amplitude.shape)
+    return columns
+
+
+def emg_process_batch(windows: np.array, sr: float) -> List[Dict]:
+    """
+    nk.emg_process of every channel of (N, T, C) windows at once, as one dict
+    of (T, C) columns per window
+    """
+    windows = np.asarray(windows, dtype=float)
+    cleaned = emg_clean(windows, sr)
+    amplitude = emg_amplitude(cleaned, sr)
+    columns = {"EMG_Raw": windows, "EMG_Clean": cleaned, "EMG_Amplitude": amplitude}
+    columns.update(emg_activation(amplitude, sr))
+    return [
+        {**{name: values[i] for name, values in columns.items()}, "sampling_rate": sr}
+        for i in range(len(windows))
+    ]
+
+
+def emg_process(data: np.array, sr: float) -> Dict:
+    """nk.emg_process of every channel of a (T, C) window, as (T, C) columns"""
+    return emg_process_batch(np.asarray(data)[None], sr)[0]
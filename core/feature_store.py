@@ -0,0 +1,105 @@
+import os
+import json
+import pickle
+import datasets
+import numpy as np
+
+from functools import partial
+from multiprocessing import Pool
+from typing import Any, List, Tuple
+
+from core.registry import DEPENDENCIES, window_digest
+from core.tracing import span
+
+# bumped whenever the derived features change, so that stored ones are rebuilt
+DERIVED_VERSION = 2
+
+# processing steps derived for the windows of each modality, besides the PSD
+MODALITY_STEPS = {
+    "ECG": ["ecg_process"],
+    "EMG": ["emg_process"],
+    "RSP": ["rsp_process"],
+}
+
+
+def derived_path(data_dir: str) -> str:
+    """Derived features of a dataset are stored next to it, e.g. HF/test_derived"""
+    return os.path.normpath(data_dir) + "_derived"
+
+
+def derive_row(data: List, sr: float, steps: List[str]) -> dict:
+    """Digest, range and pickled processing results of one window"""
+    data = np.array(data)
+    results = {}
+    for step in steps:
+        try:
+            results[step] = DEPENDENCIES[step](data, sr)
+        except Exception as e:
+            # left to be computed (and to fail) when the window is used
+            print(f"Could not derive {step}: {e}")
+    return {
+        "digest": window_digest(data),
+        "min": float(data.min()),
+        "max": float(data.max()),
+        "steps": pickle.dumps(results),
+    }
+
+
+def store_derived(
+    data_dir: str, sr: float, steps: List[str], num_workers: int = None
+) -> None:
+    """Derive the features of every window of the dataset in data_dir in parallel"""
+    ds = datasets.load_from_disk(data_dir)
+    steps = list(steps) + ["signal_psd"]
+    with span("derive", steps=steps, rows=len(ds)):
+        with Pool(num_workers) as pool:
+            rows = pool.map(
+                partial(derive_row, sr=sr, steps=steps), ds["data"], chunksize=16
+            )
+
+    out_dir = derived_path(data_dir)
+    datasets.Dataset.from_list(rows).save_to_disk(out_dir)
+    with open(os.path.join(out_dir, "derived.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": DERIVED_VERSION,
+                "sampling_rate": sr,
+                "steps": steps,
+                "num_rows": len(ds),
+            },
+            f,
+        )
+
+
+class FeatureStore:
+    """
+    Derived features stored by store_derived, one row per window of the
+    dataset. Processing results are looked up by the digest of the window.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "derived.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.ds = datasets.load_from_disk(path)
+        self.rows = {digest: i for i, digest in enumerate(self.ds["digest"])}
+
+    def matches(self, sr: float, num_rows: int) -> bool:
+        return (
+            self.meta["version"] == DERIVED_VERSION
+            and float(self.meta["sampling_rate"]) == float(sr)
+            and self.meta["num_rows"] == num_rows
+        )
+
+    def get(self, step: str, digest: str, sr: float) -> Any:
+        """The stored result of step for the window, None if it was not derived"""
+        if float(sr) != float(self.meta["sampling_rate"]):
+            return None
+        if step not in self.meta["steps"] or digest not in self.rows:
+            return None
+        with span("derived_lookup", func=step):
+            results = pickle.loads(self.ds[self.rows[digest]]["steps"])
+        return results.get(step)
+
+    def ylim(self) -> Tuple[float, float]:
+        """Range of all windows of the dataset"""
+        return min(self.ds["min"]), max(self.ds["max"])
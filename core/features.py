@@ -0,0 +1,110 @@
+import numpy as np
+import neurokit2 as nk
+
+from typing import Dict, List
+
+from core.emg import emg_process
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# keywords in the channel names that tell the physiological modality
+MODALITY_KEYWORDS = {
+    "ECG": ["ecg", "lead"],
+    "RSP": ["resp", "rsp"],
+    "EMG": ["emg"],
+}
+
+
+def channel_modality(channel: str) -> str:
+    for modality, keywords in MODALITY_KEYWORDS.items():
+        if any(keyword in channel.lower() for keyword in keywords):
+            return modality
+    return None
+
+
+def stats(data: np.array) -> Dict[str, np.array]:
+    """Statistics over time of (..., T, C) windows"""
+    percentiles = np.percentile(data, PERCENTILES, axis=-2)
+    features = {
+        "mean": data.mean(axis=-2),
+        "std": data.std(axis=-2),
+        "min": data.min(axis=-2),
+    }
+    for p, values in zip(PERCENTILES, percentiles):
+        features[f"p{p}"] = values
+    features["max"] = data.max(axis=-2)
+    return features
+
+
+def zero_crossing_rate(data: np.array, sr: float) -> np.array:
+    """Mean crossings per second of (..., T, C) windows"""
+    centered = data - data.mean(axis=-2, keepdims=True)
+    crossings = np.diff(np.signbit(centered), axis=-2).sum(axis=-2)
+    return crossings * sr / data.shape[-2]
+
+
+def band_edges(sr: float, num_bands: int) -> np.array:
+    # log-spaced between 1/100 of the Nyquist frequency and the Nyquist frequency
+    nyquist = sr / 2
+    edges = np.geomspace(nyquist / 100, nyquist, num_bands)
+    return np.concatenate([[0], edges])
+
+
+def spectrum(data: np.array, sr: float, num_peaks: int = 3, num_bands: int = 4):
+    """
+    Dominant frequencies and relative band energies of (..., T, C) windows
+    from a single FFT over all channels (and windows)
+    """
+    centered = data - data.mean(axis=-2, keepdims=True)
+    power = np.abs(np.fft.rfft(centered, axis=-2)) ** 2
+    freqs = np.fft.rfftfreq(data.shape[-2], d=1 / sr)
+
+    # strongest non-DC components, strongest first
+    order = np.argsort(power[..., 1:, :], axis=-2)[..., ::-1, :][..., :num_peaks, :]
+    peaks = freqs[1:][order]
+
+    edges = band_edges(sr, num_bands)
+    band_idx = np.clip(
+        np.searchsorted(edges, freqs, side="right") - 1, 0, num_bands - 1
+    )
+    energies = np.stack(
+        [power[..., band_idx == b, :].sum(axis=-2) for b in range(num_bands)], axis=-2
+    )
+    total = energies.sum(axis=-2, keepdims=True)
+    total[total == 0] = 1
+    return peaks, energies / total, edges
+
+
+def physio_rates(data: np.array, sr: float, channels: List[str]) -> Dict[str, list]:
+    """Rates derived with neurokit for the ECG, RSP and EMG channels of a window"""
+    rates = {}
+    # the EMG channels are processed together
+    emg_idcs = [i for i, c in enumerate(channels) if channel_modality(c) == "EMG"]
+    if emg_idcs:
+        emg_signals = emg_process(data[:, emg_idcs], sr)
+    for i, channel in enumerate(channels):
+        modality = channel_modality(channel)
+        if modality == "ECG":
+            signals, _ = nk.ecg_process(data[:, i], sampling_rate=sr)
+            values = {"heart rate (bpm)": signals["ECG_Rate"].mean()}
+        elif modality == "RSP":
+            signals, _ = nk.rsp_process(data[:, i], sampling_rate=sr)
+            values = {
+                "breathing rate (per min)": signals["RSP_Rate"].mean(),
+                "breathing amplitude": signals["RSP_Amplitude"].mean(),
+            }
+        elif modality == "EMG":
+            j = emg_idcs.index(i)
+            values = {
+                "EMG amplitude": emg_signals["EMG_Amplitude"][:, j].mean(),
+                "EMG active fraction": emg_signals["EMG_Activity"][:, j].mean(),
+            }
+        else:
+            continue
+        for name, value in values.items():
+            rates.setdefault(name, {})[channel] = value
+
+    return {
+        name: [values.get(channel) for channel in channels]
+        for name, values in rates.items()
+    }
@@ -1,5 +1,9 @@
+from typing import Dict, Tuple
+
 from openai import OpenAI
 
+from core.tracing import span
+
 
 def load_api_key(path: str) -> str:
     with open(path, "r", encoding="utf-8") as f:
@@ -14,6 +18,10 @@ class ChatGPT:
         self.temperature = temperature
 
     def ask(self, prompt: str) -> str:
+        return self.ask_with_info(prompt)[0]
+
+    def ask_with_info(self, prompt: str) -> Tuple[str, Dict]:
+        """Response with the logprobs of its tokens and the token usage"""
         client = OpenAI(api_key=self.api_key)
         chat_completion = client.chat.completions.create(
             messages=[
@@ -29,13 +37,30 @@ class ChatGPT:
             top_logprobs=20,
         )
 
-        response = chat_completion.choices[0].message.content
-        return response
+        choice = chat_completion.choices[0]
+        logprobs = []
+        if choice.logprobs is not None and choice.logprobs.content:
+            logprobs = [
+                {"token": token.token, "logprob": token.logprob}
+                for token in choice.logprobs.content
+            ]
+        usage = {}
+        if chat_completion.usage is not None:
+            details = chat_completion.usage.prompt_tokens_details
+            usage = {
+                "prompt_tokens": chat_completion.usage.prompt_tokens,
+                "completion_tokens": chat_completion.usage.completion_tokens,
+                # prompt prefixes served from the provider's prompt cache
+                "cached_tokens": (details.cached_tokens or 0) if details else 0,
+            }
+        return choice.message.content, {"logprobs": logprobs, "usage": usage}
 
 
 class LLM:
     def __init__(self, model: str, version: str, llm_path: str):
         self.name = model.lower()
+        self.version = version
+        self.llm_path = llm_path
         self.model = None
 
         if self.name == "chatgpt":
@@ -43,8 +68,17 @@ class LLM:
         else:
             raise ValueError(f"Unsupported language model: {self.name}")
 
+    def with_version(self, version: str) -> "LLM":
+        """The same model in another version"""
+        return LLM(self.name, version, self.llm_path)
+
     def generate(self, prompt: str) -> str:
+        return self.generate_with_info(prompt)[0]
+
+    def generate_with_info(self, prompt: str) -> Tuple[str, Dict]:
+        """Response with model-specific information, such as token logprobs"""
         if self.name == "chatgpt":
-            return self.model.ask(prompt)
+            with span("llm", model=self.version):
+                return self.model.ask_with_info(prompt)
         else:
             raise ValueError(f"Unsupported language model: {self.name}")
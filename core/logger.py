@@ -1,65 +1,228 @@
 import os
+import glob
+import json
+import queue
+import atexit
 import base64
-from typing import Union
+import threading
+from typing import Any, List, Union
+
+from core.archive import ArchiveSink
+from core.tracing import span
+from core.token_utils import PromptCost
+
+
+class FileSink:
+    """Writes logs as files under log_dir, remembering the directories it created"""
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.dirs = set()
+        self.makedirs(log_dir)
+
+    def makedirs(self, file_dir):
+        if file_dir not in self.dirs:
+            os.makedirs(file_dir, exist_ok=True)
+            self.dirs.add(file_dir)
+
+    def write(self, filename, content):
+        file_path = os.path.join(self.log_dir, filename)
+        self.makedirs(os.path.dirname(file_path))
+        if isinstance(content, bytes):
+            with open(file_path, "wb") as f:
+                f.write(content)
+        else:
+            with open(file_path, "w", encoding="utf-8") as f:
+                f.write(content)
+
+    def store_chat(self, filename, prompt, answer, num_tokens, latency=None, cost=None):
+        chat = "[Prompt]\n" + str(prompt) + "\n"
+        chat += "[Response]\n" + answer + "\n"
+        chat += "[Tokens]\n" + str(None if num_tokens is None else int(num_tokens))
+        # the split of prompts with images follows on its own line
+        if cost is None and hasattr(num_tokens, "to_dict"):
+            cost = num_tokens.to_dict()
+        if cost is not None and cost["num_imgs"]:
+            chat += (
+                f"\n[Token breakdown]\ntext: {cost['txt_tokens']}, "
+                f"{cost['num_imgs']} images: {cost['img_tokens']}"
+            )
+        self.write(filename, chat)
+
+    def store_img(self, filename, img):
+        if isinstance(img, str):
+            img = base64.b64decode(img)
+        self.write(filename, img)
+
+    def store(self, filename, content):
+        self.write(filename, content)
+
+    def store_event(self, kind, payload, pid):
+        # one file per process, so that processes never append to the same file
+        file_path = os.path.join(self.log_dir, "events", f"{kind}_{pid}.jsonl")
+        self.makedirs(os.path.dirname(file_path))
+        with open(file_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload) + "\n")
+
+    def events(self, kind):
+        payloads = []
+        pattern = os.path.join(self.log_dir, "events", f"{kind}_*.jsonl")
+        for file_path in sorted(glob.glob(pattern)):
+            with open(file_path, "r", encoding="utf-8") as f:
+                payloads += [json.loads(line) for line in f if line.strip()]
+        return payloads
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+SINKS = {"files": FileSink, "archive": ArchiveSink}
 
 
 class Logger:
-    def __init__(self, log_dir, debug=True):
-        self.set_dir(log_dir)
+    def __init__(
+        self,
+        log_dir,
+        debug=True,
+        async_io=False,
+        backend="files",
+        queue_size=1024,
+        batch_size=64,
+    ):
+        if backend not in SINKS:
+            raise ValueError(f"Unsupported log backend: {backend}")
         self.debug = debug
+        self.backend = backend
+        # with async_io, writes are queued and done by a writer thread
+        self.async_io = async_io
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pid = None
+        self.queue = None
+        self.writer = None
+        self.set_dir(log_dir)
+
+    def __getstate__(self):
+        # the writer thread belongs to the process that started it
+        state = self.__dict__.copy()
+        state.update(lock=None, pid=None, queue=None, writer=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
 
     def set_dir(self, log_dir):
         self.log_dir = log_dir
-        if not os.path.exists(self.log_dir):
-            os.makedirs(self.log_dir)
+        self.sink = SINKS[self.backend](log_dir)
 
     def print(self, *args, **kwargs):
         if self.debug:
             print(*args, **kwargs)
 
+    def start_writer(self):
+        # forked processes inherit the queue but not the thread, so start their own
+        self.pid = os.getpid()
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.writer = threading.Thread(target=self.drain, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def drain(self):
+        while True:
+            items = [self.queue.get()]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for item in items:
+                if item is None:
+                    stop = True
+                    continue
+                func, args = item
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"Failed to write log {args[0]}: {e}")
+            try:
+                self.sink.flush()
+            except Exception as e:
+                print(f"Failed to flush logs: {e}")
+            for _ in items:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def submit(self, name, *args):
+        func = getattr(self.sink, name)
+        with span("logging", kind=name):
+            if not self.async_io:
+                func(*args)
+                self.sink.flush()
+                return
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.start_writer()
+            self.queue.put((func, args))
+
+    def flush(self):
+        """Wait until the queued writes of this process are done"""
+        if self.writer is not None and self.pid == os.getpid():
+            self.queue.join()
+        else:
+            self.sink.flush()
+
+    def close(self):
+        if self.writer is not None and self.pid == os.getpid():
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+            self.pid = None
+        self.sink.close()
+
     def log_config(self, config):
-        with open(
-            os.path.join(self.log_dir, "config.yaml"), "w", encoding="utf-8"
-        ) as f:
-            for key, value in config.items():
-                f.write(f"{key}: {value}\n")
+        content = ""
+        for key, value in config.items():
+            content += f"{key}: {value}\n"
+        self.submit("store", "config.yaml", content)
 
     def store_chat(
         self,
         filename: str,
         prompt: str,
         answer: str,
-        num_tokens: Union[int, None] = None,
+        num_tokens: Union[int, PromptCost, None] = None,
+        latency: Union[float, None] = None,
     ) -> None:
-        file_path = os.path.join(self.log_dir, filename)
-        file_dir = os.path.dirname(file_path)
-        if not os.path.exists(file_dir):
-            os.makedirs(file_dir)
-
-        with open(os.path.join(self.log_dir, filename), "w", encoding="utf-8") as f:
-            f.write("[Prompt]\n" + str(prompt[0]["text"]) + "\n")
-            f.write("[Response]\n" + answer + "\n")
-            f.write("[Tokens]\n" + str(num_tokens))
+        self.submit(
+            "store_chat", filename, prompt[0]["text"], answer, num_tokens, latency
+        )
 
     def store_chats(self, dirname, prompts, answers):
         for i, (prompt, answer) in enumerate(zip(prompts, answers)):
-            with open(
-                os.path.join(self.log_dir, dirname, f"{i}.txt"), "w", encoding="utf-8"
-            ) as f:
-                f.write("[Prompt] " + prompt + "\n")
-                f.write("[Response] " + answer + "\n")
+            content = "[Prompt] " + prompt + "\n"
+            content += "[Response] " + answer + "\n"
+            self.submit("store", os.path.join(dirname, f"{i}.txt"), content)
 
-    def store_img(self, filename: str, img_base64: str) -> None:
-        file_path = os.path.join(self.log_dir, filename)
-        file_dir = os.path.dirname(file_path)
-        if not os.path.exists(file_dir):
-            os.makedirs(file_dir)
+    def store_img(self, filename: str, img: Union[str, bytes]) -> None:
+        """Store a PNG given as bytes or as a base64 string"""
+        self.submit("store_img", filename, img)
 
-        img_data = base64.b64decode(img_base64)
+    def store(self, filename: str, content: str) -> None:
+        self.submit("store", filename, content)
 
-        with open(os.path.join(self.log_dir, filename), "wb") as f:
-            f.write(img_data)
+    def event(self, kind: str, payload: Any) -> None:
+        """Record a JSON-serializable event, collected later with events(kind)"""
+        self.submit("store_event", kind, payload, os.getpid())
 
-    def store(self, filename: str, content: str) -> None:
-        with open(os.path.join(self.log_dir, filename), "w", encoding="utf-8") as f:
-            f.write(content)
+    def events(self, kind: str) -> List[Any]:
+        """Events of the given kind recorded by all processes of the run"""
+        self.flush()
+        return self.sink.events(kind)
@@ -0,0 +1,51 @@
+import os
+import copy
+import json
+import hashlib
+import tempfile
+
+from typing import Any, Dict
+
+
+def plan_key(fields: Dict[str, Any]) -> str:
+    """Hash of the JSON-serializable fields a plan depends on"""
+    content = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class PlanStore:
+    """
+    Visualization plans (candidates and selection) of previous runs in a JSON
+    file, keyed by plan_key. Entries are merged into the file when stored, so
+    that runs and processes sharing the file keep each other's plans.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Ignoring unreadable plan store {self.path}: {e}")
+            return {}
+
+    def get(self, key: str, field: str) -> Any:
+        value = self.load().get(key, {}).get(field)
+        return copy.deepcopy(value)
+
+    def put(self, key: str, field: str, value: Any) -> None:
+        plans = self.load()
+        plans.setdefault(key, {})[field] = value
+
+        # written to a temporary file and moved, so that readers never see a
+        # partially written store
+        store_dir = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(store_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(plans, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
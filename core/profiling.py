@@ -0,0 +1,115 @@
+import io
+import os
+import json
+import pstats
+import cProfile
+import importlib
+
+from typing import List
+
+from core.tracing import tracer, summarize, fmt_summary
+
+try:
+    from line_profiler import LineProfiler
+except ImportError:
+    LineProfiler = None
+
+# functions profiled line by line, as module:qualified name
+LINE_TARGETS = [
+    "core.visualizations.signal:raw_waveform",
+    "core.visualizer:Visualizer.gen_b64_img",
+    "core.visualizer:Visualizer.gen_png",
+    "core.visualizer:Visualizer.gen_pngs",
+    "core.vis.ecg:ecg_hb_features",
+    "core.vis.epochs:Heartbeats.__init__",
+    "data_utils.preprocessor:Preprocessor.normalize_data",
+    "data_utils.HHAR.hhar_preprocessor:HHARPreprocessor.preprocess",
+    "data_utils.Swimming.swimming_preprocessor:SwimmingPreprocessor.preprocess",
+]
+
+
+def resolve(target: str):
+    module_name, qualname = target.split(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class Profiler:
+    """
+    Profile the enclosed code with cProfile, line_profiler (for LINE_TARGETS) and
+    tracemalloc peaks per tracing span, and store the reports in out_dir:
+    profile.prof (for snakeviz or pstats), profile.txt, line_profile.txt and,
+    with stages, the span summary in stages.json.
+    """
+
+    def __init__(
+        self,
+        out_dir: str,
+        line_targets: List[str] = None,
+        top: int = 50,
+        stages: bool = True,
+    ):
+        self.out_dir = out_dir
+        # without stages, the spans are left to the caller to summarize
+        self.stages = stages
+        self.line_targets = LINE_TARGETS if line_targets is None else line_targets
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.line_profile = None
+        self.skipped = []
+
+    def __enter__(self):
+        if LineProfiler is None:
+            print("line_profiler is not installed, skipping line-level profiles")
+        else:
+            self.line_profile = LineProfiler()
+            for target in self.line_targets:
+                try:
+                    self.line_profile.add_function(resolve(target))
+                except (ImportError, AttributeError) as e:
+                    self.skipped.append(f"{target} ({e})")
+            self.line_profile.enable_by_count()
+
+        tracer.enable(track_memory=True)
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.disable()
+        if self.line_profile is not None:
+            self.line_profile.disable_by_count()
+        self.write(tracer.drain() if self.stages else [])
+        return False
+
+    def write(self, spans):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.profile.dump_stats(os.path.join(self.out_dir, "profile.prof"))
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stats.sort_stats("tottime").print_stats(self.top)
+        with open(
+            os.path.join(self.out_dir, "profile.txt"), "w", encoding="utf-8"
+        ) as f:
+            f.write(stream.getvalue())
+
+        if self.line_profile is not None:
+            stream = io.StringIO()
+            self.line_profile.print_stats(stream=stream, output_unit=1e-3)
+            for target in self.skipped:
+                stream.write(f"Skipped {target}\n")
+            with open(
+                os.path.join(self.out_dir, "line_profile.txt"), "w", encoding="utf-8"
+            ) as f:
+                f.write(stream.getvalue())
+
+        if spans:
+            summary = summarize(spans)
+            print(fmt_summary(summary))
+            with open(
+                os.path.join(self.out_dir, "stages.json"), "w", encoding="utf-8"
+            ) as f:
+                json.dump(summary, f, indent=2)
+        print(f"Profiles stored in {self.out_dir}")
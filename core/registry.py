@@ -0,0 +1,187 @@
+import hashlib
+import importlib
+import threading
+import numpy as np
+import neurokit2 as nk
+
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+from core.emg import emg_process, emg_process_batch
+from core.tracing import span
+
+
+class Visualization:
+    """
+    A visualization or text style: its catalogue entry (description and args),
+    the processing step it needs and its renderers. plot is called with the
+    Visualizer and the window, txt with the TextGenerator, the window and
+    txt_args, and both draw on the attributes of the renderer they are given.
+    Styles without a plot renderer are text-only, and unlisted styles are
+    hidden from the planning prompt.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str = "",
+        args: List[str] = None,
+        needs: str = None,
+        plot: Callable = None,
+        txt: Callable = None,
+        txt_args: Dict = None,
+        plot_takes_args: bool = False,
+        listed: bool = True,
+        subplots: bool = False,
+    ):
+        self.name = name
+        self.description = description
+        self.args = args or []
+        self.needs = needs
+        self.plot = plot
+        self.txt = txt
+        self.txt_args = txt_args or {}
+        self.plot_takes_args = plot_takes_args
+        self.listed = listed
+        # one axis per channel instead of a shared one
+        self.subplots = subplots
+
+
+REGISTRY = OrderedDict()
+
+
+def register(vis: Visualization) -> Visualization:
+    for renderer in [vis.plot, vis.txt]:
+        if renderer is not None and not callable(renderer):
+            raise TypeError(f"Renderer of {vis.name} is not callable: {renderer!r}")
+    if vis.needs is not None and vis.needs not in DEPENDENCIES:
+        raise ValueError(f"Unknown processing step of {vis.name}: {vis.needs}")
+    REGISTRY[vis.name] = vis
+    return vis
+
+
+def load():
+    """Import the modules registering the visualizations, once"""
+    # imported here, as the modules import this one to register
+    importlib.import_module("core.visualizations")
+
+
+def entries() -> List[Visualization]:
+    load()
+    return list(REGISTRY.values())
+
+
+def get(name: str) -> Visualization:
+    load()
+    return REGISTRY.get(name)
+
+
+def renderable(name: str) -> bool:
+    vis = get(name)
+    return vis is not None and vis.plot is not None
+
+
+def catalogue() -> Dict[str, Dict]:
+    """Descriptions and args of the listed visualizations, as in VISUALIZATIONS"""
+    return {
+        vis.name: {"description": vis.description, "args": list(vis.args)}
+        for vis in entries()
+        if vis.listed
+    }
+
+
+# processing steps shared by visualizations, from a (T, C) window
+DEPENDENCIES = {
+    "ecg_process": lambda data, sr: nk.ecg_process(data[:, 0], sampling_rate=sr),
+    "rsp_process": lambda data, sr: nk.rsp_process(data[:, 0], sampling_rate=sr),
+    "emg_process": emg_process,
+    "signal_psd": lambda data, sr: [
+        nk.signal_psd(data[:, i], sampling_rate=sr, method="fft")
+        for i in range(data.shape[1])
+    ],
+}
+
+
+# steps computed for a stack of same-shaped windows at once
+BATCHED = {
+    "emg_process": emg_process_batch,
+}
+
+
+def window_digest(data: np.array) -> str:
+    """Content hash of a window, including its shape and dtype"""
+    data = np.ascontiguousarray(data)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{data.shape}{data.dtype.str}".encode("utf-8"))
+    h.update(data.tobytes())
+    return h.hexdigest()
+
+
+class DependencyCache:
+    """
+    Results of the processing steps of recent windows, so that the
+    visualizations and text styles needing the same step compute it once per
+    window. Results are shared and must not be modified. Results missing from
+    the cache are looked up in the store of derived features, when one is set,
+    before they are computed.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.store = None
+
+    def get(self, dep: str, data: np.array, sr: float):
+        digest = window_digest(data)
+        key = (dep, float(sr), digest)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        result = None
+        if self.store is not None:
+            result = self.store.get(dep, digest, sr)
+        if result is None:
+            with span("neurokit", func=dep):
+                result = DEPENDENCIES[dep](np.asarray(data), sr)
+        self.put(key, result)
+        return result
+
+    def get_many(self, dep: str, windows: List[np.array], sr: float) -> List:
+        """Results for each window, computing the missing ones in one batch if possible"""
+        if dep not in BATCHED or len({np.shape(w) for w in windows}) != 1:
+            return [self.get(dep, window, sr) for window in windows]
+        keys = [(dep, float(sr), window_digest(window)) for window in windows]
+        with self.lock:
+            results = {key: self.entries[key] for key in keys if key in self.entries}
+        missing = list(
+            {key: i for i, key in enumerate(keys) if key not in results}.items()
+        )
+        if missing and self.store is not None:
+            for key, i in missing:
+                result = self.store.get(dep, key[2], sr)
+                if result is not None:
+                    results[key] = result
+            missing = [(key, i) for key, i in missing if key not in results]
+        if missing:
+            with span("neurokit", func=dep, batch=len(missing)):
+                batch = BATCHED[dep](np.stack([windows[i] for _, i in missing]), sr)
+            results.update(zip([key for key, _ in missing], batch))
+        for key in keys:
+            self.put(key, results[key])
+        return [results[key] for key in keys]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+dependency_cache = DependencyCache()
@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import numpy as np
+
+from fractions import Fraction
+from collections import OrderedDict
+from scipy.signal import resample, resample_poly
+
+RESAMPLE_METHODS = ["auto", "fft", "poly"]
+
+
+def largest_prime_factor(n: int) -> int:
+    factor, largest = 2, 1
+    while factor * factor <= n:
+        while n % factor == 0:
+            largest, n = factor, n // factor
+        factor += 1
+    return max(largest, n)
+
+
+class Resampler:
+    """
+    Resample windows along time, caching the results by window content and rates.
+
+    "fft" is scipy.signal.resample, as used before. "poly" uses rational-factor
+    polyphase filtering (scipy.signal.resample_poly) whenever sr_to / sr_from is an
+    exact fraction with numerator and denominator up to max_factor. "auto" picks
+    polyphase filtering only when the window length has a prime factor that the FFT
+    handles poorly (above 13). Polyphase output differs from the FFT output, most
+    of all near the window edges where the FFT assumes a periodic signal, so "auto"
+    keeps the FFT for every length it resamples quickly.
+    """
+
+    def __init__(self, method="auto", max_factor=1000, cache_size=256):
+        if method not in RESAMPLE_METHODS:
+            raise ValueError(f"Unsupported resampling method: {method}")
+        self.method = method
+        self.max_factor = max_factor
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.stats = {"fft": 0, "poly": 0, "cached": 0}
+        # generators of concurrent threads share the resampler
+        self.lock = threading.Lock()
+
+    def factors(self, sr_from, sr_to):
+        ratio = Fraction(sr_to) / Fraction(sr_from)
+        ratio = ratio.limit_denominator(self.max_factor)
+        if ratio.numerator > self.max_factor or ratio == 0:
+            return None
+        if abs(ratio.numerator / ratio.denominator - sr_to / sr_from) > 1e-12:
+            return None
+        return ratio.numerator, ratio.denominator
+
+    def choose(self, length, sr_from, sr_to):
+        factors = self.factors(sr_from, sr_to)
+        if self.method == "fft" or factors is None:
+            return "fft", None
+        if self.method == "poly" or largest_prime_factor(length) > 13:
+            return "poly", factors
+        return "fft", None
+
+    def describe(self, length, sr_from, sr_to):
+        method, factors = self.choose(length, sr_from, sr_to)
+        if method == "poly":
+            return (
+                f"Resampling {sr_from} Hz to {sr_to} Hz with polyphase filtering "
+                f"(up {factors[0]}, down {factors[1]})"
+            )
+        return f"Resampling {sr_from} Hz to {sr_to} Hz with FFT"
+
+    def key(self, data, sr_from, sr_to):
+        digest = hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest()
+        return (digest, data.shape, data.dtype.str, sr_from, sr_to, self.method)
+
+    def __call__(self, data, sr_from, sr_to):
+        data = np.ascontiguousarray(data)
+        if self.cache_size:
+            key = self.key(data, sr_from, sr_to)
+            with self.lock:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    self.stats["cached"] += 1
+                    return self.cache[key]
+
+        num = int(len(data) * sr_to / sr_from)
+        method, factors = self.choose(len(data), sr_from, sr_to)
+        if method == "poly":
+            resampled = resample_poly(data, factors[0], factors[1], axis=0)[:num]
+        else:
+            resampled = resample(data, num)
+
+        with self.lock:
+            self.stats[method] += 1
+            if self.cache_size:
+                resampled.setflags(write=False)
+                self.cache[key] = resampled
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return resampled
+
+
+_resamplers = {}
+_resamplers_lock = threading.Lock()
+
+
+def get_resampler(method="auto") -> Resampler:
+    """Process-wide resampler, so that its cache is shared between generators"""
+    with _resamplers_lock:
+        if method not in _resamplers:
+            _resamplers[method] = Resampler(method)
+        return _resamplers[method]
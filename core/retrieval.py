@@ -0,0 +1,100 @@
+import os
+import numpy as np
+
+from typing import Dict, List
+
+from core.features import stats, spectrum, zero_crossing_rate
+from core.tracing import span
+
+# bumped whenever feature_vectors changes, so that stored features are rebuilt
+FEATURE_VERSION = 1
+NUM_BANDS = 8
+
+
+def feature_vectors(windows: np.array, sr: float) -> np.array:
+    """
+    Compact features of (N, T, C) windows: relative FFT band energies, dominant
+    frequency, statistics and zero-crossing rate of each channel
+    """
+    windows = np.asarray(windows, dtype=np.float64)
+    peaks, energies, _ = spectrum(windows, sr, num_peaks=1, num_bands=NUM_BANDS)
+    window_stats = stats(windows)
+    features = [
+        energies,
+        peaks,
+        window_stats["mean"][:, None],
+        window_stats["std"][:, None],
+        window_stats["p5"][:, None],
+        window_stats["p50"][:, None],
+        window_stats["p95"][:, None],
+        zero_crossing_rate(windows, sr)[:, None],
+    ]
+    return np.concatenate(features, axis=1).reshape(len(windows), -1)
+
+
+def index_path(data_dir: str) -> str:
+    """Features of a dataset are stored next to it, e.g. HF/test_knn.npz"""
+    return os.path.normpath(data_dir) + "_knn.npz"
+
+
+def load_features(
+    windows_by_label: Dict[str, np.array], sr: float, path: str = None
+) -> Dict[str, np.array]:
+    """
+    Feature vectors of the windows of each label, loaded from path when they were
+    stored for the same windows and stored there otherwise
+    """
+    labels = list(windows_by_label)
+    counts = [len(windows_by_label[label]) for label in labels]
+    if path and os.path.exists(path):
+        stored = np.load(path, allow_pickle=False)
+        if (
+            int(stored["version"]) == FEATURE_VERSION
+            and float(stored["sr"]) == sr
+            and list(stored["labels"]) == labels
+            and list(stored["counts"]) == counts
+        ):
+            return {label: stored[f"features_{i}"] for i, label in enumerate(labels)}
+
+    with span("feature_extraction"):
+        features = {
+            label: feature_vectors(windows, sr)
+            for label, windows in windows_by_label.items()
+        }
+    if path:
+        np.savez(
+            path,
+            version=FEATURE_VERSION,
+            sr=sr,
+            labels=np.array(labels),
+            counts=np.array(counts),
+            **{f"features_{i}": features[label] for i, label in enumerate(labels)},
+        )
+    return features
+
+
+class KNNIndex:
+    """Nearest candidate examples of each label, by standardized feature distance"""
+
+    def __init__(self, features: Dict[str, np.array], sr: float):
+        self.sr = sr
+        stacked = np.concatenate(list(features.values()))
+        self.mean = stacked.mean(axis=0)
+        self.scale = stacked.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        self.features = {
+            label: (values - self.mean) / self.scale
+            for label, values in features.items()
+        }
+
+    def query(self, data: np.array, k: int) -> Dict[str, List[int]]:
+        """Indices of the k nearest candidates of each label, nearest first"""
+        query = feature_vectors(np.asarray(data)[None], self.sr)[0] - self.mean
+        query /= self.scale
+        nearest = {}
+        for label, values in self.features.items():
+            dists = ((values - query) ** 2).sum(axis=1)
+            k_ = min(k, len(dists))
+            idcs = np.argpartition(dists, k_ - 1)[:k_]
+            nearest[label] = idcs[np.argsort(dists[idcs])].tolist()
+        return nearest
@@ -0,0 +1,176 @@
+import numpy as np
+
+from typing import Dict, List, Tuple
+
+from core.features import stats, spectrum, zero_crossing_rate
+from core.registry import dependency_cache
+from core.vis.epochs import Heartbeats
+
+NUM_BANDS = 8
+# points of the series (rates, envelopes and beat templates) compared across windows
+NUM_POINTS = 16
+
+
+def binned(series: np.array, num_points: int = NUM_POINTS) -> np.array:
+    """Means of num_points consecutive segments of a (T, ...) series, flattened"""
+    segments = np.array_split(np.asarray(series, dtype=float), num_points)
+    return np.stack([segment.mean(axis=0) for segment in segments]).ravel()
+
+
+# the numbers each visualization is drawn from, as (N, F) features of (N, T, C)
+# windows; the physiological plots use the first channel, or all channels for EMG
+def waveform(windows: np.array, sr: float) -> np.array:
+    features = list(stats(windows).values())
+    features.append(zero_crossing_rate(windows, sr))
+    return np.concatenate(features, axis=1)
+
+
+def band_energies(windows: np.array, sr: float) -> np.array:
+    _, energies, _ = spectrum(windows, sr, num_bands=NUM_BANDS)
+    return energies.reshape(len(windows), -1)
+
+
+def ecg_signal(windows: np.array, sr: float) -> np.array:
+    rows = []
+    for window in windows:
+        signals, info = dependency_cache.get("ecg_process", window, sr)
+        clean = signals["ECG_Clean"].values
+        rows.append(
+            [
+                clean.std(),
+                clean.max() - clean.min(),
+                len(info["ECG_R_Peaks"]) / (len(window) / sr),
+            ]
+        )
+    return np.array(rows, dtype=float)
+
+
+def ecg_rate(windows: np.array, sr: float) -> np.array:
+    rows = []
+    for window in windows:
+        signals, _ = dependency_cache.get("ecg_process", window, sr)
+        rows.append(binned(signals["ECG_Rate"].values))
+    return np.array(rows)
+
+
+def ecg_beat_template(windows: np.array, sr: float) -> np.array:
+    rows = []
+    for window in windows:
+        signals, info = dependency_cache.get("ecg_process", window, sr)
+        grid, mean = Heartbeats(signals, info["ECG_R_Peaks"], sr).mean_beat()
+        # templates are compared at the same phases of the beat
+        finite = np.isfinite(mean)
+        phases = np.linspace(grid[0], grid[-1], NUM_POINTS)
+        rows.append(np.interp(phases, grid[finite], mean[finite]))
+    return np.array(rows)
+
+
+def emg_signal(windows: np.array, sr: float) -> np.array:
+    results = dependency_cache.get_many("emg_process", list(windows), sr)
+    rows = []
+    for result in results:
+        clean = result["EMG_Clean"]
+        rows.append(np.concatenate([clean.std(axis=0), np.abs(clean).max(axis=0)]))
+    return np.array(rows)
+
+
+def emg_envelope(windows: np.array, sr: float) -> np.array:
+    results = dependency_cache.get_many("emg_process", list(windows), sr)
+    return np.array([binned(result["EMG_Amplitude"]) for result in results])
+
+
+def rsp_rates(windows: np.array, sr: float) -> np.array:
+    rows = []
+    for window in windows:
+        signals, _ = dependency_cache.get("rsp_process", window, sr)
+        rows.append([signals["RSP_Rate"].mean(), signals["RSP_Amplitude"].mean()])
+    return np.array(rows, dtype=float)
+
+
+REPRESENTATIONS = {
+    "raw waveform": waveform,
+    "spectrogram": band_energies,
+    "signal power spectrum density": band_energies,
+    "ECG signal and peaks": ecg_signal,
+    "ECG heart rate": ecg_rate,
+    "ECG individual heart beats": ecg_beat_template,
+    "EMG signal": emg_signal,
+    "EMG muscle activation": emg_envelope,
+    "RSP signal": rsp_rates,
+    "RSP breathing rate": rsp_rates,
+    "RSP breathing amplitude": rsp_rates,
+    "RSP respiratory volume per time": rsp_rates,
+    "RSP cycle symmetry": rsp_rates,
+}
+
+
+def separability(features: np.array, labels: List[str]) -> float:
+    """
+    Mean over the features of the between-class share of their variance (the
+    correlation ratio), from 0 for no class differences to 1 for perfectly
+    separated classes
+    """
+    features = features[:, np.isfinite(features).all(axis=0)]
+    total = features.var(axis=0)
+    features = features[:, total > 0]
+    if features.shape[1] == 0:
+        return 0.0
+    labels = np.array(labels)
+    mean = features.mean(axis=0)
+    between = np.zeros(features.shape[1])
+    for label in np.unique(labels):
+        in_class = labels == label
+        between += in_class.mean() * (features[in_class].mean(axis=0) - mean) ** 2
+    return float(np.mean(between / total[total > 0]))
+
+
+def chance_level(labels: List[str]) -> float:
+    """Expected separability of features without class differences, (K - 1) / (N - 1)"""
+    return (len(set(labels)) - 1) / max(len(labels) - 1, 1)
+
+
+def score_candidates(
+    candidates: List[Dict], examples: List[Tuple[np.array, str]], sr: float
+) -> List[float]:
+    """Separability of each candidate, None for candidates that cannot be scored"""
+    windows = np.stack([np.asarray(ex_data) for ex_data, _ in examples])
+    labels = [ex_label for _, ex_label in examples]
+    scores = {}
+    for candidate in candidates:
+        represent = REPRESENTATIONS.get(candidate["func"])
+        if represent is None or represent in scores:
+            continue
+        try:
+            scores[represent] = separability(represent(windows, sr), labels)
+        except Exception as e:
+            # e.g. neurokit failing on data of another modality
+            print(f"Could not score {candidate['func']}: {e}")
+            scores[represent] = None
+    return [scores.get(REPRESENTATIONS.get(c["func"])) for c in candidates]
+
+
+def top_candidates(
+    candidates: List[Dict],
+    scores: List[float],
+    top_k: int,
+    min_ratio: float = 0.0,
+    chance: float = 0.0,
+) -> List[Dict]:
+    """
+    The top_k candidates by score, unscored candidates last. Scored candidates
+    below min_ratio of the best score, or not above chance, are dropped; the
+    best candidate is always kept.
+    """
+    order = sorted(
+        range(len(candidates)),
+        key=lambda i: -1 if scores[i] is None else scores[i],
+        reverse=True,
+    )
+    kept = [
+        i
+        for i in order
+        if i == order[0]
+        or scores[i] is None
+        or (scores[i] >= min_ratio * scores[order[0]] and scores[i] > chance)
+    ]
+    return [candidates[i] for i in kept[:top_k]]
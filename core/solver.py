@@ -1,18 +1,25 @@
 from typing import List, Tuple, Dict
 
 import os
+import re
 import sys
+import time
+import warnings
+import contextvars
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
 current_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(current_path, ".."))
 
 from core.llm import LLM
 from core.logger import Logger
-from core.token_utils import count_txt_tokens, count_img_tokens
-from core.visualizer import Visualizer
+from core.token_utils import count_txt_tokens, count_prompt_tokens, img_size_for_detail
+from core.token_utils import PromptCost
+from core.visualizer import Visualizer, b64encode
 from core.txt_generator import TextGenerator
-
+from core.tracing import span, set_sample
 
 INSTRUCTION = """### Instruction
 You are an expert in sensor data analysis. \
@@ -27,6 +34,57 @@ and use them to answer the following question for the target data."""
 TXT_EXAMPLES_GUIDE = """Please refer to the provided examples \
 and use them to answer the following question for the target data."""
 
+PACKED_INSTRUCTION = """### Instruction
+You are an expert in sensor data analysis. \
+Given the sensor data of several targets, determine the correct answer for each target from the options listed in the question. \
+Provide one answer per target with the format of <answer id=ID>ANSWER</answer>, \
+where ID is the number of the target and ANSWER corresponds to one of the options listed in the question. \
+If the answer is not in the options, choose the most possible option."""
+
+PACKED_EXAMPLES_GUIDE = """Please refer to the provided examples \
+and use them to answer the following question for each of the targets."""
+
+ANSWER_TAG = re.compile(
+    r"<answer\s+id\s*=\s*[\"']?(?:target\s*)?(\d+)[\"']?\s*>(.*?)</answer>",
+    re.DOTALL | re.IGNORECASE,
+)
+
+
+def img_part(png: bytes, detail: str) -> Dict:
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/jpeg;base64,{b64encode(png)}",
+            "detail": detail,
+        },
+    }
+
+
+def answer_confidence(logprobs: List[Dict]) -> float:
+    """Probability of the text in the first <answer> tag, from the token logprobs"""
+    if not logprobs:
+        return 0.0
+    text = ""
+    offsets = []
+    for token in logprobs:
+        offsets.append(len(text))
+        text += token["token"]
+    start = text.find("<answer>")
+    end = text.find("</answer>", start)
+    if start < 0 or end < 0:
+        return 0.0
+    start += len("<answer>")
+    logprob = sum(
+        token["logprob"]
+        for token, offset in zip(logprobs, offsets)
+        if offset < end and offset + len(token["token"]) > start
+    )
+    return float(np.exp(logprob))
+
+
+def target_txt(tg_id: int, tg_txt: str) -> str:
+    return f"*Target {tg_id}*:\n{tg_txt}\n\n"
+
 
 class Solver:
     """Solver class for solving sensory tasks with LLMs"""
@@ -42,114 +100,538 @@ class Solver:
         self.config = config
         self.task_metadata = task_metadata
         self.logger = logger
+        # y-range shared by all requests, set for the cached layout
+        self.ylim = None
+        # solvers (and LLM clients) of the cheaper cascade stages, built once
+        self.stages = self.build_stages() if config.get("cascade") else []
 
-    def get_ans_w_txt(
-        self, data: np.array, examples: List[Tuple[np.array, str]], log_subdir: str
-    ) -> str:
-        """Get answer with text input"""
-        tg = TextGenerator(
-            self.task_metadata["channels"],
-            self.task_metadata["sampling_rate"],
-            self.config["txt_style"],
-            self.config["txt_rounding_points"],
-            self.config["txt_sampling_rate"],
-        )
-        tg_txt = tg.gen_txt(data)
-        ex_txts = [tg.gen_txt(ex_data, ex_label) for ex_data, ex_label in examples]
+    def img_details(self) -> Tuple[str, str]:
+        """Get the image detail levels for the target and the examples"""
+        tg_detail = self.config.get("img_detail", "auto")
+        ex_detail = self.config.get("ex_img_detail") or tg_detail
+        return tg_detail, ex_detail
 
-        # compose txt
-        txt_prompt = f"{INSTRUCTION}\n\n"
+    def txt_prompt_prefix(
+        self,
+        ex_txts: List[str],
+        instruction: str = INSTRUCTION,
+        guide: str = TXT_EXAMPLES_GUIDE,
+    ) -> str:
+        """Instruction, data description and examples shared by the targets"""
+        txt_prompt = f"{instruction}\n\n"
         txt_prompt += f"{self.task_metadata['data_description']} "
-        txt_prompt += f"{TXT_EXAMPLES_GUIDE}\n\n"
+        txt_prompt += f"{guide}\n\n"
 
         txt_prompt += "### Examples\n"
         for ex_txt in ex_txts:
             txt_prompt += f"{ex_txt}\n\n"
+        return txt_prompt
 
-        txt_prompt += "### Question\n"
-        txt_prompt += f"{tg_txt}\n"
-        txt_prompt += f"*Question*: When the sensor data is used for {self.task_metadata['task_description'].strip('.')}, "
+    def question(self) -> str:
+        txt_prompt = f"*Question*: When the sensor data is used for {self.task_metadata['task_description'].strip('.')}, "
         txt_prompt += f"what is the most likely answer among {self.task_metadata['classes']}?\n*Answer*: "
+        return txt_prompt
 
-        prompt = [{"type": "text", "text": txt_prompt}]
+    def packed_question(self, num_targets: int) -> str:
+        txt_prompt = f"*Question*: When the sensor data is used for {self.task_metadata['task_description'].strip('.')}, "
+        txt_prompt += (
+            f"what is the most likely answer among {self.task_metadata['classes']} "
+        )
+        txt_prompt += f"for each of the targets 1 to {num_targets}?\n*Answers*: "
+        return txt_prompt
 
-        response = self.llm.generate(prompt)
+    def compose_txt_prompt(self, tg_txt: str, ex_txts: List[str]) -> str:
+        """Compose the text-only prompt from the target and example texts"""
+        txt_prompt = self.txt_prompt_prefix(ex_txts)
+        txt_prompt += "### Question\n"
+        txt_prompt += f"{tg_txt}\n"
+        txt_prompt += self.question()
+        return txt_prompt
 
-        num_tokens = count_txt_tokens(txt_prompt, self.config["llm_version"])
-        self.logger.store_chat(
-            os.path.join(log_subdir, "task_solver.txt"), prompt, response, num_tokens
+    def compose_packed_txt_prompt(self, tg_txts: List[str], ex_txts: List[str]) -> str:
+        """Compose the text-only prompt asking for several targets at once"""
+        txt_prompt = self.txt_prompt_prefix(
+            ex_txts, PACKED_INSTRUCTION, PACKED_EXAMPLES_GUIDE
         )
+        txt_prompt += "### Questions\n"
+        for tg_id, tg_txt in enumerate(tg_txts, 1):
+            txt_prompt += target_txt(tg_id, tg_txt)
+        txt_prompt += self.packed_question(len(tg_txts))
+        return txt_prompt
 
-        response = response.split("<answer>")[1].split("</answer>")[0].strip()
-        if response.startswith("ANSWER: "):
-            response = response.replace("ANSWER: ", "")
-        return response
+    def compose_vis_prompt(self) -> str:
+        """Compose the text of the visual prompt, which precedes the images"""
+        txt_prompt = f"{INSTRUCTION}\n\n"
+        txt_prompt += f"{self.task_metadata['data_description']} "
+        txt_prompt += f"{VIS_EXAMPLES_GUIDE}\n\n"
+        txt_prompt += "### Question\n"
+        txt_prompt += self.question()
+        return txt_prompt
 
-    def get_ans_w_vis(
-        self, data: np.array, examples: List[Tuple[np.array, str]], log_subdir: str
-    ) -> str:
-        """Get answer with visualized input"""
-        vs = Visualizer(
+    def compose_packed_vis_prompt(self, num_targets: int) -> str:
+        """Compose the text of a packed visual prompt, followed by the images"""
+        txt_prompt = f"{PACKED_INSTRUCTION}\n\n"
+        txt_prompt += f"{self.task_metadata['data_description']} "
+        txt_prompt += f"{PACKED_EXAMPLES_GUIDE}\n\n"
+        txt_prompt += "### Question\n"
+        txt_prompt += self.packed_question(num_targets)
+        return txt_prompt
+
+    def parse_answer(self, response: str) -> str:
+        """Extract the answer from the LLM response"""
+        with span("answer_parsing"):
+            response = response.split("<answer>")[1].split("</answer>")[0].strip()
+            if response.startswith("ANSWER: "):
+                response = response.replace("ANSWER: ", "")
+            return response
+
+    def parse_packed_answers(self, response: str, num_targets: int) -> Dict[int, str]:
+        """Extract the tagged answers by target id, keeping the first of each"""
+        with span("answer_parsing", packed=True):
+            answers = {}
+            for match in ANSWER_TAG.finditer(response):
+                tg_id, answer = int(match.group(1)), match.group(2).strip()
+                if answer.startswith("ANSWER: "):
+                    answer = answer.replace("ANSWER: ", "")
+                if 1 <= tg_id <= num_targets and answer:
+                    answers.setdefault(tg_id, answer)
+            return answers
+
+    def txt_generator(self) -> TextGenerator:
+        return TextGenerator(
             self.task_metadata["channels"],
             self.task_metadata["sampling_rate"],
-            self.config["vis_func"],
-            self.config["vis_args"],
+            self.config["txt_style"],
+            self.config["txt_rounding_points"],
+            self.config["txt_sampling_rate"],
+            levels=self.config.get("txt_quant_levels", 100),
+            alphabet=self.config.get("txt_sax_alphabet", 4),
+            resample_method=self.config.get("resample_method", "auto"),
         )
 
-        if self.config["vis_func"] == "raw waveform":
-            ylim_max = data.max()
-            ylim_min = data.min()
-            for ex_data, _ in examples:
-                ylim_max = max(ylim_max, ex_data.max())
-                ylim_min = min(ylim_min, ex_data.min())
+    def txt_parts(
+        self,
+        targets: List[np.array],
+        examples: List[Tuple[np.array, str]],
+        tg: TextGenerator = None,
+    ) -> Tuple[List[str], List[str]]:
+        """Serialize the examples once and each of the targets"""
+        tg = tg or self.txt_generator()
+        with span("txt_generation", style=tg.style):
+            # batched processing of the examples and all targets
+            tg.prepare(
+                [ex_data for ex_data, _ in examples] + list(targets),
+                [ex_label for _, ex_label in examples] + [None] * len(targets),
+            )
+            ex_txts = [tg.gen_txt(ex_data, ex_label) for ex_data, ex_label in examples]
+        tg_txts = []
+        for data in targets:
+            with span("txt_generation", style=tg.style):
+                tg_txts.append(tg.gen_txt(data))
+        return ex_txts, tg_txts
+
+    def txt_prompts(
+        self, targets: List[np.array], examples: List[Tuple[np.array, str]]
+    ) -> List[Tuple[List[Dict], PromptCost]]:
+        """Compose the text prompts of the targets, serializing the examples once"""
+        budget = self.config.get("txt_token_budget")
+        tg = self.txt_generator()
+        if budget:
+            # the examples are fitted once, together with the longest target
+            overhead = count_txt_tokens(
+                self.compose_txt_prompt("", [""] * len(examples)),
+                self.config["llm_version"],
+            )
+            with span("txt_fitting", style=tg.style):
+                num_tokens = tg.fit_budget(
+                    targets,
+                    examples,
+                    budget - overhead,
+                    self.config["llm_version"],
+                    self.config.get("txt_min_sampling_rate"),
+                )
+            settings = (
+                f"sampling rate {tg.txt_sr:.2f}, rounding points {tg.rp}, "
+                f"example length {tg.ex_len}"
+            )
+            if num_tokens + overhead > budget:
+                warnings.warn(
+                    f"Text budget {budget} cannot be met, prompts take up to "
+                    f"{num_tokens + overhead} tokens ({settings})"
+                )
+                self.logger.print(
+                    f"Text budget {budget} exceeded "
+                    f"({num_tokens + overhead} tokens): {settings}"
+                )
+            else:
+                self.logger.print(
+                    f"Text budget {budget} ({num_tokens + overhead} tokens used): "
+                    f"{settings}"
+                )
+
+        ex_txts, tg_txts = self.txt_parts(targets, examples, tg)
+        return [
+            self.txt_prompt(self.compose_txt_prompt(tg_txt, ex_txts))
+            for tg_txt in tg_txts
+        ]
+
+    def txt_prompt(self, txt_prompt: str) -> Tuple[List[Dict], PromptCost]:
+        prompt = [{"type": "text", "text": txt_prompt}]
+        with span("token_counting"):
+            cost = count_prompt_tokens(prompt, self.config["llm_version"])
+        return prompt, cost
+
+    def vis_parts(
+        self,
+        targets: List[np.array],
+        examples: List[Tuple[np.array, str]],
+        log_subdirs: List[str],
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """Render the examples once and each of the targets as image parts"""
+        tg_detail, ex_detail = self.img_details()
+        img_size = self.config.get("img_size", 512)
+
+        if self.config["vis_func"] == "raw waveform" and self.ylim is not None:
+            # a fixed y-range keeps the example images identical across requests
+            self.config["vis_args"]["ylim"] = self.ylim
+        elif self.config["vis_func"] == "raw waveform":
+            # one y-range for the examples and all targets, so that they share axes
+            windows = [ex_data for ex_data, _ in examples] + list(targets)
+            ylim_max = max(window.max() for window in windows)
+            ylim_min = min(window.min() for window in windows)
             self.config["vis_args"]["ylim"] = (ylim_min, ylim_max)
         # elif self.config["vis_func"] == "EMG muscle activation plot":
         #     self.config["vis_args"]["ylim"] = (0, 10)
 
+        vs = Visualizer(
+            self.task_metadata["channels"],
+            self.task_metadata["sampling_rate"],
+            self.config["vis_func"],
+            self.config["vis_args"],
+            img_size=img_size_for_detail(ex_detail, img_size),
+        )
+
         # compose imgs
-        image_urls = []
-        for i, (example_data, example_label) in enumerate(examples):
-            ex_b64_img = vs.gen_b64_img(example_data, label=example_label)
-            image_urls.append(ex_b64_img)
-            example_label = example_label.replace(" ", "_")
-            example_label = example_label.replace("/", "_")
-            example_label = example_label.replace("-", "_")
-            self.logger.store_img(
-                os.path.join(log_subdir, f"{example_label}_{i}.png"), ex_b64_img
+        windows = [example_data for example_data, _ in examples]
+        labels = [example_label for _, example_label in examples]
+        if tg_detail == ex_detail:
+            pngs = vs.gen_pngs(windows + list(targets), labels + [None] * len(targets))
+        else:
+            pngs = vs.gen_pngs(windows, labels)
+            vs.resize(img_size_for_detail(tg_detail, img_size))
+            pngs += vs.gen_pngs(targets, [None] * len(targets))
+        vs.close()
+        ex_pngs, tg_pngs = pngs[: len(examples)], pngs[len(examples) :]
+
+        for tg_png, log_subdir in zip(tg_pngs, log_subdirs):
+            for i, (example_label, ex_png) in enumerate(zip(labels, ex_pngs)):
+                example_label = example_label.replace(" ", "_")
+                example_label = example_label.replace("/", "_")
+                example_label = example_label.replace("-", "_")
+                self.logger.store_img(
+                    os.path.join(log_subdir, f"{example_label}_{i}.png"), ex_png
+                )
+            self.logger.store_img(os.path.join(log_subdir, "target.png"), tg_png)
+
+        ex_parts = [img_part(png, ex_detail) for png in ex_pngs]
+        tg_parts = [img_part(png, tg_detail) for png in tg_pngs]
+        return ex_parts, tg_parts
+
+    def vis_prompts(
+        self,
+        targets: List[np.array],
+        examples: List[Tuple[np.array, str]],
+        log_subdirs: List[str],
+    ) -> List[Tuple[List[Dict], PromptCost]]:
+        """Compose the visual prompts of the targets, rendering the examples once"""
+        ex_parts, tg_parts = self.vis_parts(targets, examples, log_subdirs)
+        return self.vis_target_prompts(ex_parts, tg_parts)
+
+    def vis_target_prompts(
+        self, ex_parts: List[Dict], tg_parts: List[Dict]
+    ) -> List[Tuple[List[Dict], PromptCost]]:
+        txt_part = {"type": "text", "text": self.compose_vis_prompt()}
+        with span("token_counting"):
+            base_cost = count_prompt_tokens(
+                [txt_part] + ex_parts, self.config["llm_version"]
             )
 
-        tg_b64_img = vs.gen_b64_img(data)
-        image_urls.append(tg_b64_img)
-        self.logger.store_img(os.path.join(log_subdir, "target.png"), tg_b64_img)
-        vs.close()
+        prompts = []
+        for tg_part in tg_parts:
+            with span("token_counting"):
+                cost = base_cost + count_prompt_tokens(
+                    [tg_part], self.config["llm_version"]
+                )
+            prompts.append(([txt_part, *ex_parts, tg_part], cost))
+        return prompts
 
-        # compose txt
-        txt_prompt = f"{INSTRUCTION}\n\n"
-        txt_prompt += f"{self.task_metadata['data_description']} "
-        txt_prompt += f"{VIS_EXAMPLES_GUIDE}\n\n"
-        txt_prompt += "### Question\n"
-        txt_prompt += f"*Question*: When the sensor data is used for {self.task_metadata['task_description'].strip('.')}, "
-        txt_prompt += f"what is the most likely answer among {self.task_metadata['classes']}?\n*Answer*: "
+    def packing(self) -> bool:
+        """Whether several targets are packed into one prompt"""
+        if self.config.get("pack_size", 1) <= 1:
+            return False
+        # a text budget bounds the prompt of a single target
+        return self.config["use_vis"] or not self.config.get("txt_token_budget")
 
-        image_urls = [f"data:image/jpeg;base64,{url}" for url in image_urls]
-        prompt = [
-            {"type": "text", "text": txt_prompt},
-            *[{"type": "image_url", "image_url": {"url": url}} for url in image_urls],
-        ]
+    def packs(self, base_tokens: int, tg_tokens: List[int]) -> List[List[int]]:
+        """Group the targets in order, within pack_size and pack_token_budget"""
+        pack_size = self.config.get("pack_size", 1)
+        budget = self.config.get("pack_token_budget")
+        packs = []
+        num_tokens = 0
+        for i, tokens in enumerate(tg_tokens):
+            if (
+                packs
+                and len(packs[-1]) < pack_size
+                and (not budget or num_tokens + tokens <= budget)
+            ):
+                packs[-1].append(i)
+                num_tokens += tokens
+            else:
+                packs.append([i])
+                num_tokens = base_tokens + tokens
+        return packs
 
-        response = self.llm.generate(prompt)
+    def pack_prompts(
+        self,
+        targets: List[np.array],
+        examples: List[Tuple[np.array, str]],
+        log_subdirs: List[str],
+    ) -> Tuple[
+        List[Tuple[List[Dict], PromptCost]],
+        List[Tuple[List[int], List[Dict], PromptCost]],
+    ]:
+        """
+        Compose the single-target prompts and the packs of targets sharing one
+        example block, as (target indices, prompt, cost)
+        """
+        llm_version = self.config["llm_version"]
+        if self.config["use_vis"]:
+            ex_parts, tg_parts = self.vis_parts(targets, examples, log_subdirs)
+            singles = self.vis_target_prompts(ex_parts, tg_parts)
+            tg_blocks = [
+                [{"type": "text", "text": f"Target {i + 1}:"}, tg_part]
+                for i, tg_part in enumerate(tg_parts)
+            ]
+
+            def compose(idcs):
+                txt = self.compose_packed_vis_prompt(len(idcs))
+                prompt = [{"type": "text", "text": txt}, *ex_parts]
+                for tg_id, i in enumerate(idcs, 1):
+                    prompt += [
+                        {"type": "text", "text": f"Target {tg_id}:"},
+                        tg_parts[i],
+                    ]
+                return prompt
+
+        else:
+            ex_txts, tg_txts = self.txt_parts(targets, examples)
+            singles = [
+                self.txt_prompt(self.compose_txt_prompt(tg_txt, ex_txts))
+                for tg_txt in tg_txts
+            ]
+            tg_blocks = [
+                [{"type": "text", "text": target_txt(i + 1, tg_txt)}]
+                for i, tg_txt in enumerate(tg_txts)
+            ]
 
-        num_tokens = count_txt_tokens(txt_prompt, self.config["llm_version"])
-        for url in image_urls:
-            num_tokens += count_img_tokens(url)
-        self.logger.store_chat(
-            os.path.join(log_subdir, "task_solver.txt"), prompt, response, num_tokens
+            def compose(idcs):
+                pack_txts = [tg_txts[i] for i in idcs]
+                txt = self.compose_packed_txt_prompt(pack_txts, ex_txts)
+                return [{"type": "text", "text": txt}]
+
+        with span("token_counting"):
+            base_tokens = count_prompt_tokens(compose([]), llm_version).num_tokens
+            tg_tokens = [
+                count_prompt_tokens(block, llm_version).num_tokens
+                for block in tg_blocks
+            ]
+
+        packs = []
+        for idcs in self.packs(base_tokens, tg_tokens):
+            if len(idcs) == 1:
+                packs.append((idcs, *singles[idcs[0]]))
+                continue
+            prompt = compose(idcs)
+            with span("token_counting"):
+                cost = count_prompt_tokens(prompt, llm_version)
+            packs.append((idcs, prompt, cost))
+        return singles, packs
+
+    def request(
+        self,
+        prompt: List[Dict],
+        cost: PromptCost,
+        log_subdirs: List[str],
+        filename: str = "task_solver.txt",
+    ) -> Tuple[str, Dict]:
+        """
+        Send a prompt to the LLM and log the chat in each of the directories,
+        returns the response and the information of LLM.generate_with_info
+        """
+        start = time.perf_counter()
+        response, info = self.llm.generate_with_info(prompt)
+        latency = time.perf_counter() - start
+
+        for log_subdir in log_subdirs:
+            self.logger.store_chat(
+                os.path.join(log_subdir, filename), prompt, response, cost, latency
+            )
+        if info.get("usage") and self.log_usage():
+            self.logger.event("usage", {"chat": log_subdirs[0], **info["usage"]})
+        return response, info
+
+    def log_usage(self) -> bool:
+        """Whether the provider's token usage of each request is recorded"""
+        return self.config.get("log_usage", False) or self.config.get("trace", False)
+
+    def ask(self, prompt: List[Dict], cost: PromptCost, log_subdir: str) -> str:
+        """Send a prompt to the LLM, log the chat and parse the answer"""
+        response, _ = self.request(prompt, cost, [log_subdir])
+        return self.parse_answer(response)
+
+    def ask_with_confidence(
+        self, prompt: List[Dict], cost: PromptCost, log_subdir: str
+    ) -> Tuple[str, float]:
+        """Answer and its probability, which is 0 for unparsable responses"""
+        response, info = self.request(prompt, cost, [log_subdir])
+        try:
+            answer = self.parse_answer(response)
+        except IndexError:
+            return None, 0.0
+        return answer, answer_confidence(info.get("logprobs"))
+
+    def ask_pack(
+        self,
+        idcs: List[int],
+        prompt: List[Dict],
+        cost: PromptCost,
+        singles: List[Tuple[List[Dict], PromptCost]],
+        log_subdirs: List[str],
+        sample_ids: List,
+    ) -> Dict[int, str]:
+        """Answer a pack of targets, asking for the ones it missed one by one"""
+        if len(idcs) == 1:
+            return {idcs[0]: self.ask(prompt, cost, log_subdirs[idcs[0]])}
+
+        response, _ = self.request(
+            prompt, cost, [log_subdirs[i] for i in idcs], "task_solver_packed.txt"
+        )
+        answers = self.parse_packed_answers(response, len(idcs))
+        results = {}
+        fallbacks = []
+        for tg_id, i in enumerate(idcs, 1):
+            if tg_id in answers:
+                results[i] = answers[tg_id]
+                continue
+            set_sample(sample_ids[i])
+            results[i] = self.ask(*singles[i], log_subdirs[i])
+            fallbacks.append(sample_ids[i])
+
+        self.logger.event(
+            "pack",
+            {
+                "samples": [sample_ids[i] for i in idcs],
+                "tokens": cost.num_tokens,
+                "single_tokens": sum(singles[i][1].num_tokens for i in idcs),
+                "fallbacks": fallbacks,
+            },
         )
+        return results
+
+    def get_ans_w_txt(
+        self, data: np.array, examples: List[Tuple[np.array, str]], log_subdir: str
+    ) -> str:
+        """Get answer with text input"""
+        prompt, cost = self.txt_prompts([data], examples)[0]
+        return self.ask(prompt, cost, log_subdir)
+
+    def get_ans_w_vis(
+        self, data: np.array, examples: List[Tuple[np.array, str]], log_subdir: str
+    ) -> str:
+        """Get answer with visualized input"""
+        prompt, cost = self.vis_prompts([data], examples, [log_subdir])[0]
+        return self.ask(prompt, cost, log_subdir)
+
+    def target_prompt(
+        self, data: np.array, examples: List[Tuple[np.array, str]], log_subdir: str
+    ) -> Tuple[List[Dict], PromptCost]:
+        if self.config["use_vis"]:
+            return self.vis_prompts([data], examples, [log_subdir])[0]
+        return self.txt_prompts([data], examples)[0]
+
+    def stage_config(self, overrides: Dict) -> Dict:
+        return {**self.config, **overrides, "cascade": False}
 
-        response = response.split("<answer>")[1].split("</answer>")[0].strip()
-        if response.startswith("ANSWER: "):
-            response = response.replace("ANSWER: ", "")
-        return response
+    def build_stages(self) -> List["Solver"]:
+        stages = []
+        llms = {self.llm.version: self.llm}
+        for overrides in self.config.get("cascade_stages") or []:
+            config = self.stage_config(overrides)
+            if config["llm_version"] not in llms:
+                llms[config["llm_version"]] = self.llm.with_version(
+                    config["llm_version"]
+                )
+            llm = llms[config["llm_version"]]
+            stages.append(Solver(llm, config, self.task_metadata, self.logger))
+        return stages
+
+    def cascade_stages(self) -> List["Solver"]:
+        """Solvers of the cheaper stages given as config overrides, then this one"""
+        # the stages follow the config as it is now, e.g. after planning
+        overrides = self.config.get("cascade_stages") or []
+        for stage, stage_overrides in zip(self.stages, overrides):
+            stage.config = self.stage_config(stage_overrides)
+            stage.ylim = self.ylim
+        return self.stages + [self]
+
+    def cascade(
+        self,
+        data: np.array,
+        examples: List[Tuple[np.array, str]],
+        log_subdir: str = "",
+    ) -> str:
+        """Answer with the cheaper stages first, escalating below cascade_threshold"""
+        threshold = self.config.get("cascade_threshold", 0.9)
+        stages = self.cascade_stages()
+        records = []
+        for k, solver in enumerate(stages):
+            final = k == len(stages) - 1
+            # the final stage logs where a sample without cascade would
+            stage_dir = (
+                log_subdir if final else os.path.join(log_subdir, f"cascade_{k}")
+            )
+            start = time.perf_counter()
+            with span("cascade", stage=k):
+                prompt, cost = solver.target_prompt(data, examples, stage_dir)
+                answer, confidence = solver.ask_with_confidence(prompt, cost, stage_dir)
+            records.append(
+                {
+                    "stage": k,
+                    "tokens": cost.num_tokens,
+                    "latency": time.perf_counter() - start,
+                    "confidence": confidence,
+                }
+            )
+            if final or confidence >= threshold:
+                break
+
+        self.logger.event("cascade", {"sample": log_subdir, "stages": records})
+        if answer is None:
+            # the final stage fails on unparsable responses, as without cascade
+            raise ValueError(f"Unparsable response in {log_subdir}")
+        return answer
+
+    def arrange_examples(
+        self, examples: List[Tuple[np.array, str]]
+    ) -> List[Tuple[np.array, str]]:
+        """Examples in the order of the classes for the cached layout"""
+        if self.config.get("prompt_layout", "default") != "cached":
+            return examples
+        classes = self.task_metadata["classes"]
+        return sorted(
+            examples,
+            key=lambda ex: classes.index(ex[1]) if ex[1] in classes else len(classes),
+        )
 
     def solve(
         self,
@@ -158,9 +640,89 @@ class Solver:
         log_subdir: str = "",
     ) -> Tuple[str, str]:
         """Solve a sensory task with LLMs"""
+        examples = self.arrange_examples(examples)
+        if self.config.get("cascade"):
+            return self.cascade(data, examples, log_subdir)
         if self.config["use_vis"]:
             answer = self.get_ans_w_vis(data, examples, log_subdir)
         else:
             answer = self.get_ans_w_txt(data, examples, log_subdir)
 
         return answer
+
+    def run_concurrently(self, func, tasks: List[Tuple], sample_ids: List) -> List:
+        """Run func on each task in a thread pool, with the sample of the task set"""
+
+        def run(sample, *args):
+            set_sample(sample)
+            return func(*args)
+
+        max_workers = min(self.config.get("max_concurrency", 8), len(tasks))
+        if max_workers <= 1:
+            # in the calling thread, which is the one seen by profilers
+            return [
+                contextvars.copy_context().run(run, sample, *args)
+                for args, sample in zip(tasks, sample_ids)
+            ]
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            futures = [
+                # each thread starts from a copy of the caller's context
+                executor.submit(contextvars.copy_context().run, run, sample, *args)
+                for args, sample in zip(tasks, sample_ids)
+            ]
+            return [future.result() for future in futures]
+
+    def solve_many(
+        self,
+        targets: List[np.array],
+        examples: List[Tuple[np.array, str]],
+        log_subdirs: List[str],
+        sample_ids: List = None,
+    ) -> List[str]:
+        """
+        Solve several targets with the same examples, preparing the examples once
+        and sending the LLM requests concurrently. With pack_size above 1, the
+        targets are packed into shared prompts. Answers are in target order.
+        """
+        targets = [np.array(data) for data in targets]
+        examples = self.arrange_examples(examples)
+        if sample_ids is None:
+            sample_ids = log_subdirs
+
+        if self.config.get("cascade"):
+            return self.run_concurrently(
+                self.cascade,
+                [
+                    (data, examples, log_subdir)
+                    for data, log_subdir in zip(targets, log_subdirs)
+                ],
+                sample_ids,
+            )
+
+        if self.packing():
+            singles, packs = self.pack_prompts(targets, examples, log_subdirs)
+            results = self.run_concurrently(
+                self.ask_pack,
+                [
+                    (idcs, prompt, cost, singles, log_subdirs, sample_ids)
+                    for idcs, prompt, cost in packs
+                ],
+                [sample_ids[idcs[0]] for idcs, _, _ in packs],
+            )
+            answers = {}
+            for pack_answers in results:
+                answers.update(pack_answers)
+            return [answers[i] for i in range(len(targets))]
+
+        if self.config["use_vis"]:
+            prompts = self.vis_prompts(targets, examples, log_subdirs)
+        else:
+            prompts = self.txt_prompts(targets, examples)
+        return self.run_concurrently(
+            self.ask,
+            [
+                (prompt, cost, log_subdir)
+                for (prompt, cost), log_subdir in zip(prompts, log_subdirs)
+            ],
+            sample_ids,
+        )
@@ -1,37 +1,180 @@
 import io
 import base64
+import struct
 import tiktoken
 
 from PIL import Image
 from math import ceil
+from typing import Dict, List, Tuple
+from functools import lru_cache
+
+# image detail levels accepted by the vision API
+IMG_DETAILS = ["auto", "low", "high"]
+# a low-detail image is billed a fixed amount regardless of its size
+LOW_DETAIL_TOKENS = 85
+# low-detail images are downscaled to 512x512 by the provider
+LOW_DETAIL_SIZE = 512
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# start-of-frame markers, which carry the size of a JPEG image
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# markers without a length field
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xDA)) | {0x01}
+
+
+@lru_cache(maxsize=None)
+def get_encoder(llm_version: str) -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model(llm_version)
 
 
 def count_txt_tokens(string: str, llm_version: str) -> int:
-    enc = tiktoken.encoding_for_model(llm_version)
+    enc = get_encoder(llm_version)
     num_tokens = len(enc.encode(string))
     return num_tokens
 
 
+def count_txt_tokens_batch(strings: List[str], llm_version: str) -> List[int]:
+    enc = get_encoder(llm_version)
+    return [len(tokens) for tokens in enc.encode_batch(strings)]
+
+
 def resize(width, height):
-    if width > 1024 or height > 1024:
+    # fit within a 2048x2048 square
+    if width > 2048 or height > 2048:
+        if width > height:
+            height = int(height * 2048 / width)
+            width = 2048
+        else:
+            width = int(width * 2048 / height)
+            height = 2048
+    # scale the shortest side down to 768
+    if min(width, height) > 768:
         if width > height:
-            height = int(height * 1024 / width)
-            width = 1024
+            width = int(width * 768 / height)
+            height = 768
         else:
-            width = int(width * 1024 / height)
-            height = 1024
+            height = int(height * 768 / width)
+            width = 768
     return width, height
 
 
-def count_img_tokens(img_b64: str) -> int:
-    if img_b64.startswith("data:image/jpeg;base64,"):
-        img_b64 = img_b64[len("data:image/jpeg;base64,") :]
-    img_data = base64.b64decode(img_b64)
-    img = Image.open(io.BytesIO(img_data))
-    width, height = img.size
-    width, height = resize(width, height)
+def img_size_for_detail(detail: str, max_size: int = 512) -> int:
+    """Largest figure side worth rendering for the given detail level"""
+    if detail == "low":
+        return min(max_size, LOW_DETAIL_SIZE)
+    return max_size
+
+
+def strip_data_url(img_b64: str) -> str:
+    if img_b64.startswith("data:"):
+        return img_b64[img_b64.index(",") + 1 :]
+    return img_b64
+
+
+def jpeg_size(data: bytes) -> Tuple[int, int]:
+    """Size in the first start-of-frame segment, None if data ends before it"""
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # fill byte
+            i += 1
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5 : i + 9])
+            return width, height
+        elif marker in JPEG_STANDALONE_MARKERS:
+            i += 2
+        else:
+            i += 2 + struct.unpack(">H", data[i + 2 : i + 4])[0]
+    return None
+
+
+def img_size(img_b64: str) -> Tuple[int, int]:
+    """Width and height of a base64 PNG or JPEG read from its header bytes"""
+    img_b64 = strip_data_url(img_b64)
+    # signature and IHDR chunk of a PNG are the first 24 bytes
+    header = base64.b64decode(img_b64[:32])
+    if header.startswith(PNG_SIGNATURE):
+        return struct.unpack(">II", header[16:24])
+    if header.startswith(b"\xff\xd8"):
+        # JPEG metadata precedes the frame header, decode until it is reached
+        num_chars = 4096
+        while True:
+            size = jpeg_size(base64.b64decode(img_b64[:num_chars]))
+            if size is not None or num_chars >= len(img_b64):
+                break
+            num_chars *= 4
+        if size is not None:
+            return size
+
+    img = Image.open(io.BytesIO(base64.b64decode(img_b64)))
+    return img.size
+
+
+def count_img_tokens(img_b64: str, detail: str = "auto") -> int:
+    if detail not in IMG_DETAILS:
+        raise ValueError(f"Unsupported image detail: {detail}")
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+
+    width, height = resize(*img_size(img_b64))
     h = ceil(height / 512)
     w = ceil(width / 512)
-    num_tokens = 85 + 170 * h * w
+    num_tokens = LOW_DETAIL_TOKENS + 170 * h * w
 
     return num_tokens
+
+
+class PromptCost:
+    """Token cost of a prompt, split into its text and its images"""
+
+    def __init__(self, txt_tokens: int = 0, img_tokens: List[int] = None):
+        self.txt_tokens = txt_tokens
+        self.img_tokens = img_tokens or []
+
+    @property
+    def num_img_tokens(self) -> int:
+        return sum(self.img_tokens)
+
+    @property
+    def num_tokens(self) -> int:
+        return self.txt_tokens + self.num_img_tokens
+
+    def __int__(self) -> int:
+        return self.num_tokens
+
+    def __add__(self, other: "PromptCost") -> "PromptCost":
+        return PromptCost(
+            self.txt_tokens + other.txt_tokens, self.img_tokens + other.img_tokens
+        )
+
+    def __str__(self) -> str:
+        if not self.img_tokens:
+            return str(self.num_tokens)
+        return (
+            f"{self.num_tokens} (text: {self.txt_tokens}, "
+            f"{len(self.img_tokens)} images: {self.num_img_tokens})"
+        )
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "num_tokens": self.num_tokens,
+            "txt_tokens": self.txt_tokens,
+            "img_tokens": self.num_img_tokens,
+            "num_imgs": len(self.img_tokens),
+        }
+
+
+def count_prompt_tokens(prompt: List[Dict], llm_version: str) -> PromptCost:
+    """Cost of a chat prompt with text and image_url contents"""
+    txts = [content["text"] for content in prompt if content["type"] == "text"]
+    img_tokens = [
+        count_img_tokens(
+            content["image_url"]["url"], content["image_url"].get("detail", "auto")
+        )
+        for content in prompt
+        if content["type"] == "image_url"
+    ]
+    return PromptCost(sum(count_txt_tokens_batch(txts, llm_version)), img_tokens)
@@ -0,0 +1,195 @@
+import os
+import time
+import threading
+import tracemalloc
+import contextvars
+import numpy as np
+
+from typing import Dict, List
+
+PERCENTILES = [50, 95, 99]
+
+# sample the spans of the current process (or thread) belong to
+sample_id = contextvars.ContextVar("sample_id", default=None)
+
+
+class Span:
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        if self.tracer.track_memory:
+            self.enter_memory()
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dur = time.perf_counter() - self.start
+        span = {
+            "name": self.name,
+            "sample": sample_id.get(),
+            "ts": self.ts,
+            "dur": dur,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "attrs": self.attrs,
+        }
+        if self.tracer.track_memory:
+            span["mem_peak"] = self.exit_memory()
+        self.tracer.record(span)
+        return False
+
+    def enter_memory(self):
+        # tracemalloc keeps a single peak, so each span resets it and hands the
+        # peak it saw on to the enclosing span of its thread when it ends. The
+        # peak is that of the whole process: spans of concurrent threads see
+        # each other's allocations and resets, so memory is only exact when
+        # a single thread is traced, as in profile mode
+        self.mem_start, self.outer_peak = tracemalloc.get_traced_memory()
+        self.child_peak = 0
+        tracemalloc.reset_peak()
+        self.tracer.mem_stack().append(self)
+
+    def exit_memory(self):
+        peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+        stack = self.tracer.mem_stack()
+        stack.pop()
+        if stack:
+            parent = stack[-1]
+            parent.child_peak = max(parent.child_peak, self.outer_peak, peak)
+        return peak - self.mem_start
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """Collects timed spans of the current process while enabled"""
+
+    def __init__(self):
+        self.enabled = False
+        self.track_memory = False
+        # spans open in each thread, for nesting their memory peaks
+        self.local = threading.local()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True, track_memory=False):
+        """
+        Record spans, with their peak traced memory if track_memory is set.
+        Peaks are process-wide, so they are only meaningful for one thread.
+        """
+        self.enabled = enabled
+        self.track_memory = enabled and track_memory
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def mem_stack(self) -> List[Span]:
+        if not hasattr(self.local, "mem_stack"):
+            self.local.mem_stack = []
+        return self.local.mem_stack
+
+    def span(self, name, **attrs):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def drain(self) -> List[Dict]:
+        # forked processes inherit the spans of their parent, keep their own only
+        with self.lock:
+            spans = [span for span in self.spans if span["pid"] == os.getpid()]
+            self.spans = []
+        return spans
+
+
+tracer = Tracer()
+
+
+def span(name, **attrs):
+    return tracer.span(name, **attrs)
+
+
+def set_sample(sample):
+    sample_id.set(sample)
+
+
+def flush_spans(logger) -> None:
+    """Hand the spans recorded so far to the logger as a single event"""
+    spans = tracer.drain()
+    if spans:
+        logger.event("spans", spans)
+
+
+def summarize(spans: List[Dict]) -> Dict[str, Dict]:
+    """Latency percentiles in milliseconds per span name"""
+    durations = {}
+    peaks = {}
+    for s in spans:
+        durations.setdefault(s["name"], []).append(s["dur"] * 1000)
+        if "mem_peak" in s:
+            peaks.setdefault(s["name"], []).append(s["mem_peak"])
+
+    summary = {}
+    for name, durs in sorted(durations.items()):
+        percentiles = np.percentile(durs, PERCENTILES)
+        summary[name] = {
+            "count": len(durs),
+            "total_ms": float(np.sum(durs)),
+            "mean_ms": float(np.mean(durs)),
+            **{f"p{p}_ms": float(v) for p, v in zip(PERCENTILES, percentiles)},
+            "max_ms": float(np.max(durs)),
+        }
+        if name in peaks:
+            summary[name]["peak_mem_kb"] = max(peaks[name]) / 1024
+    return summary
+
+
+def chrome_trace(spans: List[Dict]) -> Dict:
+    """Spans in the Chrome trace event format (chrome://tracing, Perfetto)"""
+    t0 = min((s["ts"] for s in spans), default=0)
+    events = []
+    for s in spans:
+        events.append(
+            {
+                "name": s["name"],
+                "ph": "X",
+                "ts": (s["ts"] - t0) * 1e6,
+                "dur": s["dur"] * 1e6,
+                "pid": s["pid"],
+                "tid": s["tid"],
+                "args": {"sample": s["sample"], **s["attrs"]},
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def fmt_summary(summary: Dict[str, Dict]) -> str:
+    lines = [
+        f"{'stage':24s} {'count':>6s} "
+        + " ".join(f"{f'p{p} (ms)':>10s}" for p in PERCENTILES)
+    ]
+    if any("peak_mem_kb" in stats for stats in summary.values()):
+        lines[0] += f" {'peak (KB)':>10s}"
+    for name, stats in summary.items():
+        line = f"{name:24s} {stats['count']:6d} " + " ".join(
+            f"{stats[f'p{p}_ms']:10.1f}" for p in PERCENTILES
+        )
+        if "peak_mem_kb" in stats:
+            line += f" {stats['peak_mem_kb']:10.0f}"
+        lines.append(line)
+    return "\n".join(lines)
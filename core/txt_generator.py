@@ -1,185 +1,218 @@
 import os
 import sys
+import threading
 import numpy as np
-import neurokit2 as nk
-from scipy.signal import resample
+
+from collections import OrderedDict
 
 current_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(current_path, ".."))
 
-import core.vis.ecg as ecg
+import core.registry as registry
+from core.registry import dependency_cache, window_digest
+from core.txt_serializer import LETTERS
+from core.resample import get_resampler
+from core.tracing import span
+from core.token_utils import count_txt_tokens_batch
 
 
-class TextGenerator:
-    def __init__(self, channels, sr, style, rp, txt_sr):
-        self.channels = channels
-        self.sr = sr
-        self.style = style
-        self.rp = rp
-        self.txt_sr = txt_sr
+class TokenCounts:
+    """
+    Token counts of serialized windows by window and serialization settings,
+    so that examples shared by several targets are counted once per setting
+    """
 
-    def resample(self, data, sr_from=None, sr_to=None):
-        if sr_from and sr_to:
-            return resample(data, int(len(data) * sr_to / sr_from))
-        return resample(data, int(len(data) * self.txt_sr / self.sr))
-
-    def raw_waveform(self, data):
-        txt = f"Given sensor data (list of {self.channels}): "
-        if self.sr != self.txt_sr:
-            data = self.resample(data)
-
-        if len(self.channels) == 1:
-            data = data[:, 0]
-            txt += f"[{', '.join([str(np.round(i, self.rp)) for i in data])}]"
-            return txt
-
-        samples = []
-        for i in range(len(data)):
-            samples.append(
-                f"[{', '.join([str(np.round(j, self.rp)) for j in data[i]])}]"
-            )
-        txt += f"[{', '.join(samples)}]"
-        return txt
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
 
-    def psd(self, data):
-        txt = "Given sensor data PSD (list of (frequency, density) by channels): "
-        if self.sr != self.txt_sr:
-            data = self.resample(data)
-
-        psd_samples = []
-        for i, channel in enumerate(self.channels):
-            psd = nk.signal_psd(data[:, i], sampling_rate=self.sr, method="fft")
-            psd_sample = []
-            for freq, power in zip(psd["Frequency"], psd["Power"]):
-                psd_sample.append(
-                    f"({np.round(freq, self.rp)}, {np.round(power, self.rp)})"
-                )
-            psd_samples.append(f"{channel}: [{', '.join(psd_sample)}]")
-
-        txt += f"[{', '.join(psd_samples)}]"
-        return txt
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        return None
 
-    def ecg_signal(self, data):
-        signal, _ = nk.ecg_process(data[:, 0], sampling_rate=self.sr)
-        data = signal["ECG_Clean"].values
-        txt = "Cleaned ECG signal: "
-        if self.sr != self.txt_sr:
-            data = self.resample(data)
+    def put(self, key, count):
+        with self.lock:
+            self.entries[key] = count
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
 
-        txt += f"[{', '.join([str(np.round(i, self.rp)) for i in data])}]"
-        return txt
 
-    def ecg_hr(self, data):
-        signal, info = nk.ecg_process(data[:, 0], sampling_rate=self.sr)
-        rate = signal["ECG_Rate"].values
-        peaks = info["ECG_R_Peaks"]
+token_counts = TokenCounts()
 
-        txt = f"Heart rate in the ECG signal (mean value {np.round(np.mean(rate), self.rp)}): "
-        txt += f"[{', '.join([str(np.round(i, self.rp)) for i in rate])}]\n"
-        txt += "R-peaks in the ECG signal (list of the index): "
-        txt += f"[{', '.join([str(i) for i in peaks])}]"
-        return txt
 
-    def ecg_ind(self, data):
-        signal, info = nk.ecg_process(data[:, 0], sampling_rate=self.sr)
-        heartbeats, waves = ecg.ecg_hb_features(signal, info)
-        heartbeats = heartbeats["ECG_Clean"].values
-        txt = f"Average heartbeat in the ECG signal (list of {self.channels}): "
-        txt += f"[{', '.join([str(np.round(i, self.rp)) for i in heartbeats])}]\n"
-        for k, vals in waves.items():
-            txt += f"{k} in the ECG signal (list of (index, value)): "
-            peaks = []
-            for idx, v in vals:
-                peaks.append(f"({idx}, {np.round(v, self.rp)})")
-            txt += f"[{', '.join(peaks)}]\n"
-        return txt
-
-    def emg_signal(self, data):
-        data_list = []
-        for i in range(len(data[0])):
-            signal, _ = nk.emg_process(data[:, i], sampling_rate=self.sr)
-            signal = signal["EMG_Clean"]
-            if self.sr != self.txt_sr:
-                signal = self.resample(signal)
-            data_list.append(signal)
-        txt = f"Cleaned EMG signal (list of {self.channels}): "
-        data_ = []
-        for i in range(len(data_list[0])):
-            aggregated_channel = []
-            for d in data_list:
-                aggregated_channel.append(d[i])
-            data_.append(
-                "["
-                + ", ".join([str(np.round(i, self.rp)) for i in aggregated_channel])
-                + "]"
+class TextGenerator:
+    def __init__(
+        self,
+        channels,
+        sr,
+        style,
+        rp,
+        txt_sr,
+        levels=100,
+        alphabet=4,
+        resample_method="auto",
+    ):
+        self.channels = channels
+        self.sr = sr
+        self.style = style
+        self.rp = rp
+        self.txt_sr = txt_sr
+        # number of quantization levels and size of the symbolic alphabet
+        if not 2 <= alphabet <= len(LETTERS):
+            raise ValueError(
+                f"Unsupported symbolic alphabet size: {alphabet} (from 2 to {len(LETTERS)})"
             )
-        txt += f"[{', '.join(data_)}]"
-        return txt
+        self.levels = levels
+        self.alphabet = alphabet
+        # length of the example windows in samples, None to keep them whole
+        self.ex_len = None
+        self.resample_method = resample_method
+        self.resampler = get_resampler(resample_method)
 
-    def emg_ma(self, data):
-        data_list = []
-        for i in range(len(data[0])):
-            signal, _ = nk.emg_process(data[:, i], sampling_rate=self.sr)
-            signal = signal["EMG_Amplitude"]
-            if self.sr != self.txt_sr:
-                signal = self.resample(signal)
-            data_list.append(signal)
-        txt = f"EMG muscle activation (list of {self.channels}): "
-        data_ = []
-        for i in range(len(data_list[0])):
-            aggregated_channel = []
-            for d in data_list:
-                aggregated_channel.append(d[i])
-            data_.append(
-                "["
-                + ", ".join([str(np.round(i, self.rp)) for i in aggregated_channel])
-                + "]"
-            )
-        txt += f"[{', '.join(data_)}]"
-        return txt
+    def resample(self, data, sr_from=None, sr_to=None):
+        with span("resampling"):
+            if sr_from and sr_to:
+                return self.resampler(data, sr_from, sr_to)
+            return self.resampler(data, self.sr, self.txt_sr)
+
+    def prepare(self, windows, labels=None):
+        """
+        Run the processing step of the style on the windows of a prompt at once,
+        when it can be batched, so that gen_txt picks the results up
+        """
+        vis = registry.get(self.style)
+        if len(windows) < 2 or vis is None or vis.needs not in registry.BATCHED:
+            return
+        if labels is None:
+            labels = [None] * len(windows)
+        windows = [
+            self.crop(data) if label is not None and self.ex_len is not None else data
+            for data, label in zip(windows, labels)
+        ]
+        dependency_cache.get_many(vis.needs, [np.asarray(w) for w in windows], self.sr)
+
+    def crop(self, data):
+        # keep the center of the window
+        start = (len(data) - self.ex_len) // 2
+        return data[start : start + self.ex_len]
+
+    def fit_sr(self, measure, budget, min_sr, max_sr, max_iter=4):
+        # tokens grow almost linearly with the sampling rate,
+        # so a few regula falsi steps find the highest rate that fits
+        self.txt_sr = max_sr
+        t_hi = measure()
+        if t_hi <= budget:
+            return True
+        self.txt_sr = min_sr
+        t_lo = measure()
+        if t_lo > budget:
+            return False
+
+        lo, hi = min_sr, max_sr
+        for _ in range(max_iter):
+            if t_hi <= t_lo or hi - lo < 0.01 * hi:
+                break
+            sr = lo + (hi - lo) * (budget - t_lo) / (t_hi - t_lo)
+            self.txt_sr = min(max(sr, lo), hi)
+            t = measure()
+            if t <= budget:
+                lo, t_lo = self.txt_sr, t
+            else:
+                hi, t_hi = self.txt_sr, t
+        self.txt_sr = lo
+        return True
+
+    def count_tokens(self, windows, labels, digests, llm_version):
+        """Token counts of the texts of the windows at the current settings"""
+        settings = (
+            tuple(self.channels),
+            self.style,
+            self.sr,
+            self.txt_sr,
+            self.rp,
+            self.levels,
+            self.alphabet,
+            self.resample_method,
+            llm_version,
+        )
+        # only the examples are cropped to ex_len
+        keys = [
+            (digest, label, self.ex_len if label is not None else None) + settings
+            for digest, label in zip(digests, labels)
+        ]
+        counts = [token_counts.get(key) for key in keys]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            self.prepare([windows[i] for i in missing], [labels[i] for i in missing])
+            txts = [self.gen_txt(windows[i], labels[i]) for i in missing]
+            for i, count in zip(missing, count_txt_tokens_batch(txts, llm_version)):
+                counts[i] = count
+                token_counts.put(keys[i], count)
+        return counts
+
+    def fit_budget(self, targets, examples, budget, llm_version, min_sr=None):
+        """
+        Fit the texts of the examples and of each of the targets into budget
+        tokens by lowering the sampling rate down to min_sr, then the rounding
+        points, and finally the length of the examples. The settings are shared
+        by the targets, so the examples are fitted once with the longest target.
+        Returns the tokens of the examples and the longest target, which exceed
+        the budget if it cannot be met.
+        """
+        num_targets = len(targets)
+        windows = list(targets) + [ex_data for ex_data, _ in examples]
+        labels = [None] * num_targets + [ex_label for _, ex_label in examples]
+        digests = [window_digest(w) for w in windows]
+        max_sr = self.txt_sr
+        if min_sr is None:
+            min_sr = max_sr / 4
+        min_sr = min(min_sr, max_sr)
+
+        def measure():
+            counts = self.count_tokens(windows, labels, digests, llm_version)
+            measure.tg_tokens = max(counts[:num_targets], default=0)
+            measure.ex_tokens = sum(counts[num_targets:])
+            return measure.tg_tokens + measure.ex_tokens
+
+        fitted = self.fit_sr(measure, budget, min_sr, max_sr)
+        while not fitted and self.rp > 0:
+            self.rp -= 1
+            self.txt_sr = min_sr
+            if measure() <= budget:
+                fitted = self.fit_sr(measure, budget, min_sr, max_sr)
+
+        # shorten the examples as a last resort
+        for _ in range(3):
+            if measure() <= budget:
+                break
+            ex_budget = budget - measure.tg_tokens
+            if measure.ex_tokens == 0 or ex_budget <= 0:
+                break
+            ex_len = self.ex_len or min(len(w) for w in windows[num_targets:])
+            self.ex_len = max(int(ex_len * ex_budget / measure.ex_tokens * 0.98), 1)
+            try:
+                measure()
+            except ValueError:
+                # the style cannot process windows that short
+                self.ex_len = None if ex_len == len(windows[num_targets]) else ex_len
+                break
+
+        return measure()
 
     def gen_txt(self, data, label=None):
         txt = ""
         if not label is None:
             txt += f"*Example of {label}*:\n"
-        if self.style == "raw waveform":
-            txt += f"{self.raw_waveform(data)}"
-        elif self.style == "spectrogram":
-            # spectrograms cannot be expressed in text
-            txt += f"{self.raw_waveform(data)}"
-        elif self.style == "signal power spectrum density":
-            txt += f"{self.psd(data)}"
-        elif self.style == "ECG signal and peaks":
-            txt += f"{self.ecg_signal(data)}"
-        elif self.style == "ECG heart rate":
-            txt += f"{self.ecg_hr(data)}"
-        elif self.style == "ECG individual heart beats":
-            txt += f"{self.ecg_ind(data)}"
-        elif self.style == "EMG signal":
-            txt += f"{self.emg_signal(data)}"
-        elif self.style == "EMG muscle activation":
-            txt += f"{self.emg_ma(data)}"
-
-        # The following visualizations were not selected from our visualization tool filtering
-        # The results can be reproduced without the functions
-
-        # elif self.style == "EDA signal":
-        #     txt += f"{self.eda_signal(data)}"
-        # elif self.style == "EDA skin conductance response (SCR)":
-        #     txt += f"{self.eda_scr(data)}"
-        # elif self.style == "EDA skin conductance level (SCL)":
-        #     txt += f"{self.eda_scl(data)}"
-        # elif self.style == "RSP signal":
-        #     txt += f"{self.rsp_signal(data)}"
-        # elif self.style == "RSP breathing rate":
-        #     txt += f"{self.rsp_br(data)}"
-        # elif self.style == "RSP breathing amplitude":
-        #     txt += f"{self.rsp_ba(data)}"
-        # elif self.style == "RSP respiratory volume per time":
-        #     txt += f"{self.rsp_vpt(data)}"
-        # elif self.style == "RSP cycle symmetry":
-        #     txt += f"{self.rsp_cs(data)}"
-
-        else:
-            txt += f"{self.raw_waveform(data)}"
+            if self.ex_len is not None:
+                data = self.crop(data)
+        vis = registry.get(self.style)
+        if vis is None or vis.txt is None:
+            # styles without a text form fall back to the raw waveform
+            vis = registry.get("raw waveform")
+        txt += f"{vis.txt(self, data, **vis.txt_args)}"
         return txt
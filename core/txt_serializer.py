@@ -0,0 +1,141 @@
+import io
+import numpy as np
+
+from scipy.stats import norm
+
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+
+
+def fmt_values(values, rp=None) -> np.array:
+    """Format a whole array as str(np.round(v, rp)) does for each element"""
+    arr = np.asarray(values)
+    if rp is not None:
+        arr = np.round(arr, rp)
+    if arr.dtype == np.float64 or np.issubdtype(arr.dtype, np.integer):
+        # python floats and ints share numpy's shortest round-trip repr
+        strs = list(map(repr, arr.ravel().tolist()))
+    else:
+        strs = [str(v) for v in arr.ravel()]
+
+    fmt = np.empty(len(strs), dtype=object)
+    fmt[:] = strs
+    return fmt.reshape(arr.shape)
+
+
+def interleave(items: np.array, sep: str, row_sep: str = None) -> str:
+    """Join a (rows, cols) array of strings with separators placed by array ops"""
+    rows, cols = items.shape
+    seps = np.full((rows, cols), sep, dtype=object)
+    if row_sep is not None:
+        seps[:, -1] = row_sep
+    seps[-1, -1] = ""
+
+    out = np.empty((rows, 2 * cols), dtype=object)
+    out[:, 0::2] = items
+    out[:, 1::2] = seps
+    return "".join(out.ravel().tolist())
+
+
+class TextWriter:
+    """Streaming writer of serialized sensor data into a single buffer"""
+
+    def __init__(self, rp):
+        self.rp = rp
+        self.buf = io.StringIO()
+
+    def write(self, txt: str) -> "TextWriter":
+        self.buf.write(txt)
+        return self
+
+    def values(self, values, rp=None) -> "TextWriter":
+        # [v1, v2, ...]
+        rp = self.rp if rp is None else rp
+        fmt = fmt_values(values, rp)
+        self.buf.write("[")
+        if len(fmt) > 0:
+            self.buf.write(interleave(fmt.reshape(-1, 1), ", "))
+        self.buf.write("]")
+        return self
+
+    def rows(self, values, rp=None) -> "TextWriter":
+        # [[v11, v12, ...], [v21, v22, ...], ...] with one row per sample
+        rp = self.rp if rp is None else rp
+        fmt = fmt_values(values, rp)
+        self.buf.write("[")
+        if fmt.size > 0:
+            self.buf.write("[")
+            self.buf.write(interleave(fmt, ", ", "], ["))
+            self.buf.write("]")
+        self.buf.write("]")
+        return self
+
+    def pairs(self, first, second, rp=None) -> "TextWriter":
+        # [(a1, b1), (a2, b2), ...]
+        rp = self.rp if rp is None else rp
+        fmt = np.stack([fmt_values(first, rp), fmt_values(second, rp)], axis=1)
+        self.buf.write("[")
+        if len(fmt) > 0:
+            self.buf.write("(")
+            self.buf.write(interleave(fmt, ", ", "), ("))
+            self.buf.write(")")
+        self.buf.write("]")
+        return self
+
+    def ints(self, values) -> "TextWriter":
+        # v1 v2 v3 ...
+        self.buf.write(" ".join(map(str, np.asarray(values).tolist())))
+        return self
+
+    def deltas(self, values) -> "TextWriter":
+        # v1 +d2 -d3 ...
+        values = np.asarray(values).tolist()
+        self.buf.write(" ".join([str(values[0])] + [f"{v:+d}" for v in values[1:]]))
+        return self
+
+    def runs(self, symbols) -> "TextWriter":
+        # a3 b1 c2 ...
+        values, counts = run_lengths(symbols)
+        runs = np.char.add(LETTERS[values], counts.astype(str))
+        self.buf.write(" ".join(runs.tolist()))
+        return self
+
+    def getvalue(self) -> str:
+        return self.buf.getvalue()
+
+
+def quantize(data: np.array, levels: int):
+    """Quantize each channel to integers 0..levels-1 with value = offset + scale * q"""
+    offset = data.min(axis=0)
+    scale = (data.max(axis=0) - offset) / (levels - 1)
+    scale[scale == 0] = 1
+    q = np.rint((data - offset) / scale).astype(np.int64)
+    return q, offset, scale
+
+
+def delta(q: np.array) -> np.array:
+    """First sample followed by the differences to the previous sample"""
+    return np.concatenate([q[:1], np.diff(q, axis=0)], axis=0)
+
+
+def sax(data: np.array, seg_len: int, alphabet: int):
+    """Symbolic aggregate approximation of each channel with per-segment means"""
+    mean = data.mean(axis=0)
+    std = data.std(axis=0)
+    std[std == 0] = 1
+    z = (data - mean) / std
+
+    # piecewise aggregate approximation
+    num_segs = max(len(z) // seg_len, 1)
+    seg_len = min(seg_len, len(z))
+    paa = z[: num_segs * seg_len].reshape(num_segs, seg_len, -1).mean(axis=1)
+
+    breakpoints = norm.ppf(np.arange(1, alphabet) / alphabet)
+    symbols = np.searchsorted(breakpoints, paa)
+    return symbols, breakpoints, mean, std
+
+
+def run_lengths(symbols: np.array):
+    """Run-length encode a 1-D sequence into (values, counts)"""
+    starts = np.flatnonzero(np.concatenate([[True], symbols[1:] != symbols[:-1]]))
+    counts = np.diff(np.append(starts, len(symbols)))
+    return symbols[starts], counts
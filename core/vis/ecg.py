@@ -2,25 +2,23 @@ import numpy as np
 import matplotlib.pyplot as plt
 import neurokit2 as nk
 
+from core.vis.epochs import Heartbeats, WAVES
+
 
 def ecg_hb_features(signals, info):
-    hbs = nk.ecg_segment(signals, info["ECG_R_Peaks"], info["sampling_rate"])
-    df = nk.epochs_to_df(hbs)
-    # Get main signal column name
-    col = [c for c in ["Signal", "ECG_Raw", "ECG_Clean"] if c in df.columns][-1]
+    hbs = Heartbeats(signals, info["ECG_R_Peaks"], info["sampling_rate"])
     # Average heartbeat
-    mean_heartbeat = df.groupby("Time")[[col]].mean()
+    _, mean_heartbeat = hbs.mean_beat()
 
     waves = {}
-    # Plot individual waves
-    for wave in ["P", "Q", "S", "T"]:
-        wave_col = f"ECG_{wave[0]}_Peaks"
+    for wave in WAVES:
+        wave_col = f"ECG_{wave}_Peaks"
         waves[wave_col] = []
-        if wave_col in df.columns:
-            series = df[col][df[wave_col] == 1]
-            for t, val in series.items():
-                if not np.isnan(val):
-                    waves[wave_col].append((t, val))
+        peaks = hbs.waves(wave)
+        if peaks is not None:
+            positions, _, values = peaks
+            keep = ~np.isnan(values)
+            waves[wave_col] = list(zip(positions[keep].tolist(), values[keep].tolist()))
 
     return mean_heartbeat, waves
 
@@ -55,19 +53,18 @@ def ecg_plot_hr(signals, info, ax=None):
 
 
 def ecg_plot_ind(signals, info, ax=None):
-    nk.ecg_segment(
-        signals,
-        info["ECG_R_Peaks"],
-        info["sampling_rate"],
-        show="return",
-        ax=ax,
+    hbs = Heartbeats(signals, info["ECG_R_Peaks"], info["sampling_rate"])
+    if ax is None:
+        _, ax = plt.subplots()
+    ax.set_title(
+        f"Individual Heart Beats (average heart rate: {hbs.heart_rate:0.1f} bpm)"
     )
+    ecg_segment_plot(hbs, ax, linewidth=7, show_beats=True)
+    return ax
 
 
-def ecg_segment_plot(hbs, ax):
-    df = nk.epochs_to_df(hbs)
-    col = [c for c in ["Signal", "ECG_Raw", "ECG_Clean"] if c in df.columns][-1]
-    mean_heartbeat = df.groupby("Time")[[col]].mean()
+def ecg_segment_plot(hbs, ax, linewidth=5, show_beats=False):
+    times, mean_beat = hbs.mean_beat()
 
     ax.set_xlabel("Time (seconds)")
     ax.set_ylabel("ECG")
@@ -77,29 +74,31 @@ def ecg_segment_plot(hbs, ax):
 
     # Plot average heartbeat
     ax.plot(
-        mean_heartbeat.index,
-        mean_heartbeat,
+        times,
+        mean_beat,
         color="#F44336",
-        linewidth=5,
+        linewidth=linewidth,
         label="Average beat shape",
         zorder=1,
     )
 
+    if show_beats:
+        times, beats = hbs.beats()
+        # Alpha of individual beats decreases with more heartbeats
+        alpha = 1 / np.log2(np.log2(1 + beats.shape[1]))
+        ax.plot(times, beats, color="grey", linewidth=alpha, alpha=alpha, zorder=2)
+
     # Plot individual waves
-    for wave in [
-        ("P", "#3949AB"),
-        ("Q", "#1E88E5"),
-        ("S", "#039BE5"),
-        ("T", "#00ACC1"),
-    ]:
-        wave_col = f"ECG_{wave[0]}_Peaks"
-        if wave_col in df.columns:
+    for wave, color in zip(WAVES, ["#3949AB", "#1E88E5", "#039BE5", "#00ACC1"]):
+        peaks = hbs.waves(wave)
+        if peaks is not None:
+            _, wave_times, values = peaks
             ax.scatter(
-                df["Time"][df[wave_col] == 1],
-                df[col][df[wave_col] == 1],
-                color=wave[1],
+                wave_times,
+                values,
+                color=color,
                 marker="+",
-                label=f"{wave[0]}-waves",
+                label=f"{wave}-waves",
                 zorder=3,
             )
 
@@ -234,16 +233,17 @@ def _ecg_peaks_plot_artefacts(
     raw = [s for s in info.keys() if str(s).endswith("Peaks_Uncorrected")]
     if len(raw) == 0:
         return "No correction"
-    raw = info[raw[0]]
+    raw = np.asarray(info[raw[0]])
     if len(raw) == 0:
         return "No bad peaks"
-    if any([i < len(signal) for i in raw]):
+    if np.any(raw < len(signal)):
         return (
             "Peak indices longer than signal. Signals might have been cropped. "
             + "Better skip plotting."
         )
 
-    extra = [i for i in raw if i not in peaks]
+    peaks = np.asarray(peaks)
+    extra = raw[~np.isin(raw, peaks)]
     if len(extra) > 0:
         ax.scatter(
             x_axis[extra],
@@ -254,7 +254,7 @@ def _ecg_peaks_plot_artefacts(
             zorder=2,
         )
 
-    added = [i for i in peaks if i not in raw]
+    added = peaks[~np.isin(peaks, raw)]
     if len(added) > 0:
         ax.scatter(
             x_axis[added],
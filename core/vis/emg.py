@@ -2,17 +2,11 @@ import numpy as np
 import pandas as pd
 
 
-def emg_plot_signal(emg_signals, info=None, ax=None, label=None):
-    if not isinstance(emg_signals, pd.DataFrame):
-        raise ValueError(
-            "NeuroKit error: The `emg_signals` argument must"
-            " be the DataFrame returned by `emg_process()`."
-        )
-
-    sampling_rate = info["sampling_rate"]
-    x_axis = np.linspace(
-        0, emg_signals.shape[0] / info["sampling_rate"], emg_signals.shape[0]
-    )
+def emg_plot_signal(emg_signals, channel, ax=None, label=None):
+    # emg_signals are the (T, C) columns of core.emg.emg_process
+    sampling_rate = emg_signals["sampling_rate"]
+    clean = emg_signals["EMG_Clean"][:, channel]
+    x_axis = np.linspace(0, len(clean) / sampling_rate, len(clean))
 
     if sampling_rate is not None:
         ax.set_xlabel("Time (seconds)")
@@ -23,27 +17,19 @@ def emg_plot_signal(emg_signals, info=None, ax=None, label=None):
     ax.set_title("Raw and Cleaned Signal")
     ax.plot(
         x_axis,
-        emg_signals["EMG_Clean"],
+        clean,
         label=f"Cleaned {label}",
         zorder=1,
         linewidth=1.5,
     )
 
 
-def emg_plot_act(emg_signals, info=None, ax=None, label=None):
-    # Sanity-check input.
-    if not isinstance(emg_signals, pd.DataFrame):
-        raise ValueError(
-            "NeuroKit error: The `emg_signals` argument must"
-            " be the DataFrame returned by `emg_process()`."
-        )
-
+def emg_plot_act(emg_signals, channel, ax=None, label=None):
     # Determine what to display on the x-axis, mark activity.
-    x_axis = np.linspace(
-        0, emg_signals.shape[0] / info["sampling_rate"], emg_signals.shape[0]
-    )
+    sampling_rate = emg_signals["sampling_rate"]
+    amplitude = emg_signals["EMG_Amplitude"][:, channel]
+    x_axis = np.linspace(0, len(amplitude) / sampling_rate, len(amplitude))
 
-    sampling_rate = info["sampling_rate"]
     if sampling_rate is not None:
         ax.set_xlabel("Time (seconds)")
     elif sampling_rate is None:
@@ -53,7 +39,7 @@ def emg_plot_act(emg_signals, info=None, ax=None, label=None):
     ax.set_title("Muscle Activation")
     ax.plot(
         x_axis,
-        emg_signals["EMG_Amplitude"],
+        amplitude,
         # color="#FF9800",
         # label="Amplitude",
         label=label,
@@ -0,0 +1,79 @@
+import numpy as np
+
+# columns holding the ECG signal, the last one present is used
+SIGNAL_COLUMNS = ["Signal", "ECG_Raw", "ECG_Clean"]
+WAVES = ["P", "Q", "S", "T"]
+
+
+class Heartbeats:
+    """
+    Heartbeats of a processed ECG signal, cut around its R-peaks with the
+    windows of nk.ecg_segment and gathered with an index matrix instead of
+    one DataFrame per beat. Samples of all beats are kept concatenated in beat
+    order, as in nk.epochs_to_df: time (seconds from the R-peak), beat and the
+    values of the signal and wave columns.
+    """
+
+    def __init__(self, signals, rpeaks, sampling_rate, ratio_pre=0.35):
+        length = len(signals)
+        if length < sampling_rate * 4:
+            raise ValueError("The data length is too small to be segmented.")
+        self.col = [c for c in SIGNAL_COLUMNS if c in signals.columns][-1]
+        self.heart_rate = float(np.mean(signals["ECG_Rate"].values))
+
+        window = 60 / self.heart_rate
+        start = -ratio_pre * window
+        end = (1 - ratio_pre) * window
+        # signals are padded so that the first and last beats are complete
+        pad = int((end - start) * sampling_rate)
+
+        rpeaks = np.asarray(rpeaks, dtype=int) + pad
+        starts = (rpeaks + start * sampling_rate).astype(int)
+        lengths = (rpeaks + end * sampling_rate).astype(int) - starts
+        offsets = np.arange(lengths.max())
+        valid = offsets[None, :] < lengths[:, None]
+        idcs = starts[:, None] + offsets[None, :]
+
+        # beats whose window is one sample shorter have their own time grid
+        times = np.full(idcs.shape, np.nan)
+        for n in np.unique(lengths):
+            times[lengths == n, :n] = np.linspace(start, end, n)
+
+        self.time = times[valid]
+        self.beat = np.broadcast_to(np.arange(len(starts))[:, None], idcs.shape)[valid]
+        self.values = {}
+        wave_cols = [f"ECG_{wave}_Peaks" for wave in WAVES]
+        for col in [self.col] + [c for c in wave_cols if c in signals.columns]:
+            values = signals[col].values
+            fill = np.nan if np.issubdtype(values.dtype, np.floating) else 0
+            padding = np.full(pad, fill, dtype=values.dtype)
+            padded = np.concatenate([padding, values, padding])
+            self.values[col] = padded[idcs][valid]
+
+    def mean_beat(self):
+        """Times and mean of the signal over the beats at each time, ignoring NaNs"""
+        grid, inverse = np.unique(self.time, return_inverse=True)
+        values = self.values[self.col]
+        finite = ~np.isnan(values)
+        sums = np.bincount(inverse[finite], values[finite], minlength=len(grid))
+        counts = np.bincount(inverse[finite], minlength=len(grid))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return grid, sums / counts
+
+    def beats(self):
+        """Times and (times, beats) signal of every beat, NaN where a beat has no sample"""
+        grid, inverse = np.unique(self.time, return_inverse=True)
+        matrix = np.full((len(grid), self.beat.max() + 1), np.nan)
+        matrix[inverse, self.beat] = self.values[self.col]
+        # beats in the order of the labels of nk.ecg_segment ("1", "10", "2", ...),
+        # so that overlapping beats blend as they did
+        order = sorted(range(matrix.shape[1]), key=lambda i: str(i + 1))
+        return grid, matrix[:, order]
+
+    def waves(self, wave):
+        """Positions (in the concatenated beats), times and signal of the wave's peaks"""
+        wave_col = f"ECG_{wave}_Peaks"
+        if wave_col not in self.values:
+            return None
+        positions = np.flatnonzero(self.values[wave_col] == 1)
+        return positions, self.time[positions], self.values[self.col][positions]
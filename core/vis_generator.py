@@ -1,102 +1,28 @@
 import os
 import sys
+import time
 import json
+import hashlib
 
 current_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(current_path, ".."))
 
-from core.visualizer import Visualizer
-
-VISUALIZATIONS = {
-    "raw waveform": {
-        "description": "This generates a raw signal of sensor data, displaying the amplitude of the signal over time. This is usually used to visualize the raw data and identify patterns in the signal.",
-        "args": [],
-    },
-    "spectrogram": {
-        "description": """This generates a spectrogram of sensor data, showing the density of frequencies over time. This is usually used to visualize the frequency components for high-frequency data which has features over components but is hard to figure out in the raw plot. It takes the length of the FFT used (nfft), the length of each segment (nperseg), and the number of points to overlap between segments (noverlap) as parameters. Different modes (mode) can be defined to specify the type of return values: ["psd" for power spectral density, "complex" for complex-valued STFT results, "magnitude" for absolute magnitude, "angle" for complex angle, and "phase" for unwrapped phase angle].""",
-        "args": ["nfft", "nperseg", "noverlap", "mode"],
-    },
-    "signal power spectrum density": {
-        "description": "This generates a power spectrum density plot, which shows the power of each frequency component of the signal on the x-axis. This is usually used to analyze the power distribution of different frequency components in the signal.",
-        "args": [],
-    },
-    "EDA signal": {
-        "description": "This generates a plot showing both raw and cleaned Electrodermal Activity (EDA) signals over time. This is usually used to analyze the EDA signals for patterns related to stress, arousal, or other psychological states.",
-        "args": [],
-    },
-    "EDA skin conductance response (SCR)": {
-        "description": "This generates a plot of skin conductance response (SCR) for EDA data, highlighting the phasic component, onsets, peaks, and half-recovery times. This is usually used to study the transient responses in EDA data related to specific stimuli or events.",
-        "args": [],
-    },
-    "EDA skin conductance level (SCL)": {
-        "description": "This generates a plot of skin conductance level (SCL) for EDA data over time. This is usually used to analyze the tonic component of EDA data, reflecting the overall level of arousal or stress over a period.",
-        "args": [],
-    },
-    "ECG signal and peaks": {
-        "description": "This generates a plot for Electrocardiogram (ECG) data, showing the raw signal, cleaned signal, and R peaks marked as dots to indicate heartbeats. This is usually used to analyze the heartbeats and detect anomalies in the ECG signal.",
-        "args": [],
-    },
-    "ECG heart rate": {
-        "description": "This generates a heart rate plot for ECG data, displaying the heart rate over time along with its mean value. This is usually used to monitor and analyze heart rate variability and trends over time.",
-        "args": [],
-    },
-    "ECG individual heart beats": {
-        "description": "This generates a plot of individual heartbeats and the average heart rate for ECG data. It aggregates heartbeats within an ECG recording and shows the average beat shape, marking P-waves, Q-waves, S-waves, and T-waves. This is usually used to study the morphology of individual heartbeats and identify irregularities.",
-        "args": [],
-    },
-    # "RSP signal": {
-    #     "description": "This generates a plot showing both raw and cleaned Respiration (RSP) signals over time, including exhalation and inhalation onsets and durations. This is usually used to analyze the breathing patterns and detect any abnormalities in respiration.",
-    #     "args": [],
-    # },
-    # "RSP breathing rate": {
-    #     "description": "This generates a breathing rate plot for RSP data, showing the breathing rate over time and its mean value. This is usually used to monitor and analyze the breathing rate and detect any irregularities.",
-    #     "args": [],
-    # },
-    # "RSP breathing amplitude": {
-    #     "description": "This generates a breathing amplitude plot for RSP data, displaying the amplitude of breaths over time. This is usually used to measure the depth of breathing and identify changes in breathing patterns.",
-    #     "args": [],
-    # },
-    # "RSP respiratory volume per time": {
-    #     "description": "This generates a plot of respiratory volume per time (RVT) for RSP data, showing RVT values and their mean over time. This is usually used to analyze the respiratory volume and detect any anomalies in breathing.",
-    #     "args": [],
-    # },
-    # "RSP cycle symmetry": {
-    #     "description": "This generates a cycle symmetry plot for RSP data, displaying peak-trough symmetry and rise-decay symmetry plots. This is usually used to study the symmetry of the breathing cycles and identify any asymmetries.",
-    #     "args": [],
-    # },
-    "PPG signal and peaks": {
-        "description": "This generates a plot for Photoplethysmogram (PPG) data, showing the raw signal, cleaned signal, and systolic peaks marked as dots. This is usually used to analyze the blood volume pulse and detect anomalies in the PPG signal.",
-        "args": [],
-    },
-    "PPG heart rate": {
-        "description": "This generates a heart rate plot for PPG data, displaying the heart rate over time and its mean value. This is usually used to monitor and analyze heart rate variability and trends over time based on PPG data.",
-        "args": [],
-    },
-    "PPG individual heart beats": {
-        "description": "This generates a plot of individual heartbeats and the average heart rate for PPG data, aggregating individual heartbeats within a PPG recording and showing the average beat shape. This is usually used to study the morphology of individual heartbeats based on PPG data.",
-        "args": [],
-    },
-    "EMG signal": {
-        "description": "This generates a plot showing both raw and cleaned Electromyogram (EMG) signals over time. This is usually used to analyze muscle activity and identify patterns in muscle contractions.",
-        "args": [],
-    },
-    "EMG muscle activation": {
-        "description": "This generates a muscle activation plot for EMG data, displaying the amplitudes of muscle activity and highlighting activated parts with lines. This is usually used to study muscle activation levels and identify specific periods of muscle activity.",
-        "args": [],
-    },
-    "EOG signal": {
-        "description": "This generates a plot showing both raw and cleaned Electrooculogram (EOG) signals over time, with blinks marked as dots. This is usually used to analyze eye movement patterns and detect blinks.",
-        "args": [],
-    },
-    "EOG blink rate": {
-        "description": "This generates a blink rate plot for EOG data, displaying the blink rate over time and its mean value. This is usually used to monitor and analyze the blink rate and detect any irregularities.",
-        "args": [],
-    },
-    "EOG individual blinks": {
-        "description": "This generates a plot of individual blinks for EOG data, aggregating individual blinks within an EOG recording and showing the median blink shape. This is usually used to study the morphology of individual blinks and identify patterns in blink dynamics.",
-        "args": [],
-    },
-}
+from core.visualizer import Visualizer, b64encode
+from core.token_utils import count_prompt_tokens, img_size_for_detail
+from core.tracing import span
+from core.plan_store import PlanStore, plan_key
+from core.separability import score_candidates, top_candidates, chance_level
+import core.registry as registry
+
+VISUALIZATIONS = registry.catalogue()
+
+# changes whenever the catalogue changes, invalidating the stored plans
+VISUALIZATIONS_VERSION = hashlib.sha256(
+    json.dumps(VISUALIZATIONS, sort_keys=True).encode("utf-8")
+).hexdigest()[:16]
+
+# selected when none of the planned visualizations can be rendered
+FALLBACK = {"func": "raw waveform", "args": {}, "knowledge": ""}
 
 PLAN_INSTRUCTION = """### Instructions
 You need to determine effective visualization methods for the given task. \
@@ -136,15 +62,54 @@ Task description: A task for detecting whether the user is running or not using
 Response: {"func": "ECG heart rate", "args": {}, "knowledge": "Use this to monitor heart rate over time and analyze activity levels. A significant increase in heart rate can indicate that the user is running. The plot should show a higher average heart rate during running periods compared to resting or walking periods. Sudden spikes and consistent high heart rates are typical indicators of running."}"""
 
 
+def extract_json(text: str, opener: str):
+    """
+    First JSON value starting with opener ("[" or "{") in text, skipping any
+    surrounding prose, e.g. '{"func": "raw waveform"}' in 'Answer: {"func": ...}.'
+    """
+    decoder = json.JSONDecoder()
+    start = text.find(opener)
+    while start >= 0:
+        try:
+            value, _ = decoder.raw_decode(text, start)
+            return value
+        except json.JSONDecodeError:
+            start = text.find(opener, start + 1)
+    raise ValueError(f"No JSON value starting with {opener} in response: {text}")
+
+
 class VisualizationGenerator:
-    def __init__(self, llm, task_metadata, logger):
+    def __init__(
+        self,
+        llm,
+        task_metadata,
+        logger,
+        img_detail="auto",
+        img_size=512,
+        plan_store_path=None,
+    ):
         self.visualizations = VISUALIZATIONS
         self.llm = llm
         self.logger = logger
+        self.img_detail = img_detail
+        self.img_size = img_size_for_detail(img_detail, img_size)
         self.task_desc = task_metadata["task_description"]
         self.data_desc = task_metadata["data_description"]
         self.sr = task_metadata["sampling_rate"]
         self.channels = task_metadata["channels"]
+        self.store = PlanStore(plan_store_path) if plan_store_path else None
+
+    def plan_key(self):
+        return plan_key(
+            {
+                "task_description": self.task_desc,
+                "data_description": self.data_desc,
+                "channels": self.channels,
+                "sampling_rate": self.sr,
+                "visualizations": VISUALIZATIONS_VERSION,
+                "model": self.llm.version,
+            }
+        )
 
     def vis_descriptions(self):
         description_text = ""
@@ -182,11 +147,18 @@ class VisualizationGenerator:
                 candidate["args"]["ylim"] = (ylim_min, ylim_max)
 
             visualizer = Visualizer(
-                self.channels, self.sr, candidate["func"], candidate["args"]
+                self.channels,
+                self.sr,
+                candidate["func"],
+                candidate["args"],
+                img_size=self.img_size,
             )
-            for i, (example_data, example_label) in enumerate(examples):
-                b64_img = visualizer.gen_b64_img(example_data, example_label)
-                img_urls.append(b64_img)
+            pngs = visualizer.gen_pngs(
+                [example_data for example_data, _ in examples],
+                [example_label for _, example_label in examples],
+            )
+            for i, ((_, example_label), png) in enumerate(zip(examples, pngs)):
+                img_urls.append(b64encode(png))
                 example_label = example_label.replace(" ", "_")
                 example_label = example_label.replace("/", "_")
                 example_label = example_label.replace("-", "_")
@@ -194,7 +166,7 @@ class VisualizationGenerator:
                     os.path.join(
                         log_dir, f"{candidate['func']}_{example_label}_{i}.png"
                     ),
-                    b64_img,
+                    png,
                 )
             visualizer.close()
 
@@ -208,34 +180,120 @@ class VisualizationGenerator:
         urls = [f"data:image/jpeg;base64,{url}" for url in img_urls]
         prompt = [
             {"type": "text", "text": txt_prompt},
-            *[{"type": "image_url", "image_url": {"url": f"{url}"}} for url in urls],
+            *[
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"{url}", "detail": self.img_detail},
+                }
+                for url in urls
+            ],
         ]
 
         return prompt
 
-    def select(self, candidates, examples, log_dir):
+    def prune(self, candidates, score_examples, top_k, min_ratio, log_dir):
+        """
+        Keep the top_k candidates by the class separability of their data,
+        dropping those below min_ratio of the best score or at chance level
+        """
+        with span("vis_scoring"):
+            scores = score_candidates(candidates, score_examples, self.sr)
+        chance = chance_level([ex_label for _, ex_label in score_examples])
+        kept = top_candidates(candidates, scores, top_k, min_ratio, chance)
+        self.logger.store(
+            os.path.join(log_dir, "vis_scores.json"),
+            json.dumps(
+                {
+                    "chance": chance,
+                    "scores": [
+                        {"func": c["func"], "score": s, "kept": c in kept}
+                        for c, s in zip(candidates, scores)
+                    ],
+                },
+                indent=2,
+            ),
+        )
+        return kept
+
+    def select(
+        self,
+        candidates,
+        examples,
+        log_dir,
+        score_examples=None,
+        top_k=None,
+        min_separability=0.0,
+    ):
+        if self.store is not None:
+            selected = self.store.get(self.plan_key(), "selected")
+            if selected is not None:
+                self.logger.print(
+                    f"Loaded visualization {selected['func']} from plan store"
+                )
+                return selected
+
+        # candidates the Visualizer cannot draw are dropped, falling back to the
+        # raw waveform when none is left
+        renderable = [c for c in candidates if registry.renderable(c["func"])]
+        if not renderable:
+            self.logger.print(
+                "No renderable visualization among "
+                f"{[c['func'] for c in candidates]}, falling back to {FALLBACK['func']}"
+            )
+            renderable = [dict(FALLBACK)]
+        candidates = renderable
+        if top_k and score_examples:
+            candidates = self.prune(
+                candidates, score_examples, top_k, min_separability, log_dir
+            )
+        if len(candidates) == 1:
+            selected = candidates[0]
+        else:
+            selected = self.ask_selection(candidates, examples, log_dir)
+
+        if self.store is not None and selected is not None:
+            # the y-range follows the examples, so it is not stored
+            args = {k: v for k, v in selected["args"].items() if k != "ylim"}
+            self.store.put(self.plan_key(), "selected", {**selected, "args": args})
+        return selected
+
+    def ask_selection(self, candidates, examples, log_dir):
         prompt = self.get_selection_prompt(candidates, examples, log_dir)
+        start = time.perf_counter()
         res = self.llm.generate(prompt)
-        self.logger.store_chat(os.path.join(log_dir, "vis_selection.txt"), prompt, res)
+        latency = time.perf_counter() - start
+        with span("token_counting"):
+            cost = count_prompt_tokens(prompt, self.llm.version)
+        self.logger.store_chat(
+            os.path.join(log_dir, "vis_selection.txt"), prompt, res, cost, latency
+        )
 
-        while res[0] != "{":
-            res = res[1:]
-        while res[-1] != "}":
-            res = res[:-1]
-        res = json.loads(res)
+        with span("answer_parsing", step="vis_selection"):
+            res = extract_json(res, "{")
 
         for candidate in candidates:
             if candidate["func"] == res["func"]:
                 return candidate
 
     def plan(self, log_dir):
+        if self.store is not None:
+            candidates = self.store.get(self.plan_key(), "candidates")
+            if candidates is not None:
+                self.logger.print("Loaded visualization candidates from plan store")
+                return candidates
+
         prompt = self.get_planning_prompt()
+        start = time.perf_counter()
         res = self.llm.generate(prompt)
-        self.logger.store_chat(os.path.join(log_dir, "vis_plan.txt"), prompt, res)
-        while res[0] != "[":
-            res = res[1:]
-        while res[-1] != "]":
-            res = res[:-1]
-        res = json.loads(res)
+        latency = time.perf_counter() - start
+        with span("token_counting"):
+            cost = count_prompt_tokens(prompt, self.llm.version)
+        self.logger.store_chat(
+            os.path.join(log_dir, "vis_plan.txt"), prompt, res, cost, latency
+        )
+        with span("answer_parsing", step="vis_plan"):
+            res = extract_json(res, "[")
 
+        if self.store is not None:
+            self.store.put(self.plan_key(), "candidates", res)
         return res
@@ -0,0 +1,16 @@
+"""
+Visualizations and text styles, each module registering its own with their
+renderers. Modules are imported in the order of the planning catalogue, and any
+other module of the package after them, so that a new modality is added by a
+single module.
+"""
+
+import pkgutil
+import importlib
+
+ORDER = ["signal", "eda", "ecg", "ppg", "emg", "eog", "rsp", "text"]
+
+for name in ORDER + sorted(
+    module.name for module in pkgutil.iter_modules(__path__) if module.name not in ORDER
+):
+    importlib.import_module(f"{__name__}.{name}")
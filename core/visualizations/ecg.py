@@ -0,0 +1,93 @@
+import numpy as np
+
+import core.vis.ecg as ecg
+from core.registry import Visualization, register, dependency_cache
+from core.txt_serializer import TextWriter
+
+
+def plot_ecg(vs, data):
+    vs.canvas.cla()
+    signals, info = dependency_cache.get("ecg_process", data, vs.sr)
+    ecg.ecg_plot_signal(signals, info, vs.canvas)
+    vs.canvas.set_title(vs.plot)
+
+
+def plot_ecg_hr(vs, data):
+    vs.canvas.cla()
+    signals, info = dependency_cache.get("ecg_process", data, vs.sr)
+    ecg.ecg_plot_hr(signals, info, vs.canvas)
+    vs.canvas.set_title(vs.plot)
+
+
+def plot_ecg_ind(vs, data):
+    vs.canvas.cla()
+    signals, info = dependency_cache.get("ecg_process", data, vs.sr)
+    ecg.ecg_plot_ind(signals, info, vs.canvas)
+    vs.canvas.set_title(vs.plot)
+
+
+def ecg_signal(tg, data):
+    signal, _ = dependency_cache.get("ecg_process", data, tg.sr)
+    data = signal["ECG_Clean"].values
+    txt = TextWriter(tg.rp).write("Cleaned ECG signal: ")
+    if tg.sr != tg.txt_sr:
+        data = tg.resample(data)
+
+    return txt.values(data).getvalue()
+
+
+def ecg_hr(tg, data):
+    signal, info = dependency_cache.get("ecg_process", data, tg.sr)
+    rate = signal["ECG_Rate"].values
+    peaks = info["ECG_R_Peaks"]
+
+    txt = TextWriter(tg.rp)
+    txt.write(
+        f"Heart rate in the ECG signal (mean value {np.round(np.mean(rate), tg.rp)}): "
+    )
+    txt.values(rate).write("\n")
+    txt.write("R-peaks in the ECG signal (list of the index): ")
+    txt.values(peaks)
+    return txt.getvalue()
+
+
+def ecg_ind(tg, data):
+    signal, info = dependency_cache.get("ecg_process", data, tg.sr)
+    heartbeats, waves = ecg.ecg_hb_features(signal, info)
+    txt = TextWriter(tg.rp)
+    txt.write(f"Average heartbeat in the ECG signal (list of {tg.channels}): ")
+    txt.values(heartbeats).write("\n")
+    for k, vals in waves.items():
+        txt.write(f"{k} in the ECG signal (list of (index, value)): ")
+        idcs = [idx for idx, _ in vals]
+        txt.pairs(idcs, [v for _, v in vals]).write("\n")
+    return txt.getvalue()
+
+
+register(
+    Visualization(
+        "ECG signal and peaks",
+        "This generates a plot for Electrocardiogram (ECG) data, showing the raw signal, cleaned signal, and R peaks marked as dots to indicate heartbeats. This is usually used to analyze the heartbeats and detect anomalies in the ECG signal.",
+        needs="ecg_process",
+        plot=plot_ecg,
+        txt=ecg_signal,
+    )
+)
+register(
+    Visualization(
+        "ECG heart rate",
+        "This generates a heart rate plot for ECG data, displaying the heart rate over time along with its mean value. This is usually used to monitor and analyze heart rate variability and trends over time.",
+        needs="ecg_process",
+        plot=plot_ecg_hr,
+        txt=ecg_hr,
+    )
+)
+register(
+    Visualization(
+        "ECG individual heart beats",
+        "This generates a plot of individual heartbeats and the average heart rate for ECG data. It aggregates heartbeats within an ECG recording and shows the average beat shape, marking P-waves, Q-waves, S-waves, and T-waves. This is usually used to study the morphology of individual heartbeats and identify irregularities.",
+        needs="ecg_process",
+        plot=plot_ecg_ind,
+        txt=ecg_ind,
+    )
+)
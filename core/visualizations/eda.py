@@ -0,0 +1,22 @@
+from core.registry import Visualization, register
+
+# The EDA, PPG and EOG visualizations were not selected from our visualization
+# tool filtering and have no renderer; the results can be reproduced without them
+register(
+    Visualization(
+        "EDA signal",
+        "This generates a plot showing both raw and cleaned Electrodermal Activity (EDA) signals over time. This is usually used to analyze the EDA signals for patterns related to stress, arousal, or other psychological states.",
+    )
+)
+register(
+    Visualization(
+        "EDA skin conductance response (SCR)",
+        "This generates a plot of skin conductance response (SCR) for EDA data, highlighting the phasic component, onsets, peaks, and half-recovery times. This is usually used to study the transient responses in EDA data related to specific stimuli or events.",
+    )
+)
+register(
+    Visualization(
+        "EDA skin conductance level (SCL)",
+        "This generates a plot of skin conductance level (SCL) for EDA data over time. This is usually used to analyze the tonic component of EDA data, reflecting the overall level of arousal or stress over a period.",
+    )
+)
@@ -0,0 +1,62 @@
+import numpy as np
+
+import core.vis.emg as emg
+from core.registry import Visualization, register, dependency_cache
+from core.txt_serializer import TextWriter
+
+
+def plot_emg(vs, data):
+    vs.canvas.cla()
+    signals = dependency_cache.get("emg_process", data, vs.sr)
+    for i, channel in enumerate(vs.channels):
+        emg.emg_plot_signal(signals, i, ax=vs.canvas, label=channel)
+    vs.canvas.legend()
+    vs.canvas.set_title(vs.plot)
+
+
+def plot_emg_act(vs, data):
+    vs.canvas.cla()
+    signals = dependency_cache.get("emg_process", data, vs.sr)
+    for i, channel in enumerate(vs.channels):
+        emg.emg_plot_act(signals, i, ax=vs.canvas, label=channel)
+    vs.canvas.legend()
+    vs.canvas.set_title(vs.plot)
+
+
+def emg_channels(tg, data, column):
+    signals = dependency_cache.get("emg_process", data, tg.sr)[column]
+    if tg.sr != tg.txt_sr:
+        signals = tg.resample(signals)
+    return np.asarray(signals)
+
+
+def emg_signal(tg, data):
+    txt = TextWriter(tg.rp)
+    txt.write(f"Cleaned EMG signal (list of {tg.channels}): ")
+    return txt.rows(emg_channels(tg, data, "EMG_Clean")).getvalue()
+
+
+def emg_ma(tg, data):
+    txt = TextWriter(tg.rp)
+    txt.write(f"EMG muscle activation (list of {tg.channels}): ")
+    return txt.rows(emg_channels(tg, data, "EMG_Amplitude")).getvalue()
+
+
+register(
+    Visualization(
+        "EMG signal",
+        "This generates a plot showing both raw and cleaned Electromyogram (EMG) signals over time. This is usually used to analyze muscle activity and identify patterns in muscle contractions.",
+        needs="emg_process",
+        plot=plot_emg,
+        txt=emg_signal,
+    )
+)
+register(
+    Visualization(
+        "EMG muscle activation",
+        "This generates a muscle activation plot for EMG data, displaying the amplitudes of muscle activity and highlighting activated parts with lines. This is usually used to study muscle activation levels and identify specific periods of muscle activity.",
+        needs="emg_process",
+        plot=plot_emg_act,
+        txt=emg_ma,
+    )
+)
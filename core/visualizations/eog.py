@@ -0,0 +1,21 @@
+from core.registry import Visualization, register
+
+# offered to the planner, without a renderer (see eda.py)
+register(
+    Visualization(
+        "EOG signal",
+        "This generates a plot showing both raw and cleaned Electrooculogram (EOG) signals over time, with blinks marked as dots. This is usually used to analyze eye movement patterns and detect blinks.",
+    )
+)
+register(
+    Visualization(
+        "EOG blink rate",
+        "This generates a blink rate plot for EOG data, displaying the blink rate over time and its mean value. This is usually used to monitor and analyze the blink rate and detect any irregularities.",
+    )
+)
+register(
+    Visualization(
+        "EOG individual blinks",
+        "This generates a plot of individual blinks for EOG data, aggregating individual blinks within an EOG recording and showing the median blink shape. This is usually used to study the morphology of individual blinks and identify patterns in blink dynamics.",
+    )
+)
@@ -0,0 +1,21 @@
+from core.registry import Visualization, register
+
+# offered to the planner, without a renderer (see eda.py)
+register(
+    Visualization(
+        "PPG signal and peaks",
+        "This generates a plot for Photoplethysmogram (PPG) data, showing the raw signal, cleaned signal, and systolic peaks marked as dots. This is usually used to analyze the blood volume pulse and detect anomalies in the PPG signal.",
+    )
+)
+register(
+    Visualization(
+        "PPG heart rate",
+        "This generates a heart rate plot for PPG data, displaying the heart rate over time and its mean value. This is usually used to monitor and analyze heart rate variability and trends over time based on PPG data.",
+    )
+)
+register(
+    Visualization(
+        "PPG individual heart beats",
+        "This generates a plot of individual heartbeats and the average heart rate for PPG data, aggregating individual heartbeats within a PPG recording and showing the average beat shape. This is usually used to study the morphology of individual heartbeats based on PPG data.",
+    )
+)
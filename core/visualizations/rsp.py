@@ -0,0 +1,62 @@
+import core.vis.rsp as rsp
+from core.registry import Visualization, register, dependency_cache
+
+
+def rsp_plotter(plot_func):
+    """Renderer drawing the processed RSP signal with one of the core.vis.rsp plots"""
+
+    def plot(vs, data):
+        vs.canvas.cla()
+        signal, info = dependency_cache.get("rsp_process", data, vs.sr)
+        plot_func(signal, info, vs.canvas)
+        vs.canvas.set_title(vs.plot)
+
+    return plot
+
+
+# rendered, but not offered to the planner
+register(
+    Visualization(
+        "RSP signal",
+        "This generates a plot showing both raw and cleaned Respiration (RSP) signals over time, including exhalation and inhalation onsets and durations. This is usually used to analyze the breathing patterns and detect any abnormalities in respiration.",
+        needs="rsp_process",
+        plot=rsp_plotter(rsp.rsp_plot_signal),
+        listed=False,
+    )
+)
+register(
+    Visualization(
+        "RSP breathing rate",
+        "This generates a breathing rate plot for RSP data, showing the breathing rate over time and its mean value. This is usually used to monitor and analyze the breathing rate and detect any irregularities.",
+        needs="rsp_process",
+        plot=rsp_plotter(rsp.rsp_plot_br),
+        listed=False,
+    )
+)
+register(
+    Visualization(
+        "RSP breathing amplitude",
+        "This generates a breathing amplitude plot for RSP data, displaying the amplitude of breaths over time. This is usually used to measure the depth of breathing and identify changes in breathing patterns.",
+        needs="rsp_process",
+        plot=rsp_plotter(rsp.rsp_plot_ba),
+        listed=False,
+    )
+)
+register(
+    Visualization(
+        "RSP respiratory volume per time",
+        "This generates a plot of respiratory volume per time (RVT) for RSP data, showing RVT values and their mean over time. This is usually used to analyze the respiratory volume and detect any anomalies in breathing.",
+        needs="rsp_process",
+        plot=rsp_plotter(rsp.rsp_plot_vbt),
+        listed=False,
+    )
+)
+register(
+    Visualization(
+        "RSP cycle symmetry",
+        "This generates a cycle symmetry plot for RSP data, displaying peak-trough symmetry and rise-decay symmetry plots. This is usually used to study the symmetry of the breathing cycles and identify any asymmetries.",
+        needs="rsp_process",
+        plot=rsp_plotter(rsp.rsp_plot_cs),
+        listed=False,
+    )
+)
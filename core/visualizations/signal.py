@@ -0,0 +1,98 @@
+import numpy as np
+
+from core.registry import Visualization, register, dependency_cache
+from core.txt_serializer import TextWriter
+
+
+def plot_waveform(vs, data, **kwargs):
+    vs.canvas.cla()
+    vs.canvas.set_title(vs.plot)
+    vs.canvas.set_xlabel("Time [sec]")
+    vs.canvas.set_ylabel("Normalized value")
+    for i, channel in enumerate(vs.channels):
+        vs.canvas.plot(np.arange(len(data)) / vs.sr, data[:, i], label=channel)
+    vs.canvas.legend()
+    vs.canvas.set_ylim(kwargs["ylim"])
+
+
+def plot_spectrogram(vs, data, **kwargs):
+    frequencies, times, Sxx = vs.spectrogram(data, **kwargs)
+    for i, c in enumerate(vs.channels):
+        if len(vs.channels) == 1:
+            canvas = vs.canvas
+        else:
+            canvas = vs.canvas[i]
+        canvas.cla()
+        canvas.set_title(vs.plot + " of " + c)
+        canvas.set_xlabel("Time [sec]")
+        canvas.set_ylabel("Frequency [Hz]")
+        canvas.pcolormesh(times, frequencies, Sxx[:, i], shading="gouraud")
+
+
+def plot_psd(vs, data):
+    vs.canvas.cla()
+    vs.canvas.set_title(vs.plot)
+    vs.canvas.set_xlabel("Frequency [Hz]")
+    vs.canvas.set_ylabel("Power [dB]")
+    psds = dependency_cache.get("signal_psd", data, vs.sr)
+    for channel, psd in zip(vs.channels, psds):
+        vs.canvas.loglog(psd["Frequency"], psd["Power"], label=channel)
+    vs.canvas.legend()
+
+
+def raw_waveform(tg, data):
+    txt = TextWriter(tg.rp)
+    txt.write(f"Given sensor data (list of {tg.channels}): ")
+    if tg.sr != tg.txt_sr:
+        data = tg.resample(data)
+
+    if len(tg.channels) == 1:
+        return txt.values(data[:, 0]).getvalue()
+    return txt.rows(data).getvalue()
+
+
+def psd(tg, data):
+    txt = TextWriter(tg.rp)
+    txt.write("Given sensor data PSD (list of (frequency, density) by channels): [")
+    if tg.sr != tg.txt_sr:
+        data = tg.resample(data)
+
+    psds = dependency_cache.get("signal_psd", data, tg.sr)
+    for i, (channel, channel_psd) in enumerate(zip(tg.channels, psds)):
+        if i > 0:
+            txt.write(", ")
+        txt.write(f"{channel}: ").pairs(channel_psd["Frequency"], channel_psd["Power"])
+
+    return txt.write("]").getvalue()
+
+
+register(
+    Visualization(
+        "raw waveform",
+        "This generates a raw signal of sensor data, displaying the amplitude of the signal over time. This is usually used to visualize the raw data and identify patterns in the signal.",
+        plot=plot_waveform,
+        txt=raw_waveform,
+        plot_takes_args=True,
+    )
+)
+register(
+    Visualization(
+        "spectrogram",
+        """This generates a spectrogram of sensor data, showing the density of frequencies over time. This is usually used to visualize the frequency components for high-frequency data which has features over components but is hard to figure out in the raw plot. It takes the length of the FFT used (nfft), the length of each segment (nperseg), and the number of points to overlap between segments (noverlap) as parameters. Different modes (mode) can be defined to specify the type of return values: ["psd" for power spectral density, "complex" for complex-valued STFT results, "magnitude" for absolute magnitude, "angle" for complex angle, and "phase" for unwrapped phase angle].""",
+        args=["nfft", "nperseg", "noverlap", "mode"],
+        plot=plot_spectrogram,
+        # spectrograms cannot be expressed in text
+        txt=raw_waveform,
+        plot_takes_args=True,
+        subplots=True,
+    )
+)
+register(
+    Visualization(
+        "signal power spectrum density",
+        "This generates a power spectrum density plot, which shows the power of each frequency component of the signal on the x-axis. This is usually used to analyze the power distribution of different frequency components in the signal.",
+        needs="signal_psd",
+        plot=plot_psd,
+        txt=psd,
+    )
+)
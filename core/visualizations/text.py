@@ -0,0 +1,103 @@
+import numpy as np
+
+from core.registry import Visualization, register
+from core.txt_serializer import TextWriter, fmt_values, quantize, delta, sax
+from core.features import stats, zero_crossing_rate, spectrum, physio_rates
+
+
+def quantized(tg, data, deltas=False):
+    if tg.sr != tg.txt_sr:
+        data = tg.resample(data)
+    q, offset, scale = quantize(data, tg.levels)
+
+    txt = TextWriter(tg.rp)
+    if deltas:
+        q = delta(q)
+        txt.write("Delta-encoded quantized sensor data (value = offset + scale * q, ")
+        txt.write("listing the first q and then the change from the previous sample):")
+    else:
+        txt.write("Quantized sensor data (value = offset + scale * q, ")
+        txt.write(f"q from 0 to {tg.levels - 1}):")
+    for i, channel in enumerate(tg.channels):
+        txt.write(f"\n{channel} (offset {offset[i]:.4g}, scale {scale[i]:.4g}): ")
+        if deltas:
+            txt.deltas(q[:, i])
+        else:
+            txt.ints(q[:, i])
+    return txt.getvalue()
+
+
+def symbolic(tg, data):
+    seg_len = max(int(round(tg.sr / tg.txt_sr)), 1)
+    symbols, breakpoints, mean, std = sax(data, seg_len, tg.alphabet)
+
+    legend = [f"a (< {breakpoints[0]:.2f})"]
+    for j in range(1, len(breakpoints)):
+        legend.append(
+            f"{chr(ord('a') + j)} ({breakpoints[j - 1]:.2f} to {breakpoints[j]:.2f})"
+        )
+    legend.append(f"{chr(ord('a') + len(breakpoints))} (> {breakpoints[-1]:.2f})")
+
+    txt = TextWriter(tg.rp)
+    txt.write(
+        f"Symbolic sensor data (each symbol is the mean of {seg_len / tg.sr:.3g} "
+        f"seconds in standard deviations from the channel mean: {', '.join(legend)}; "
+        "runs are written as the symbol followed by its count):"
+    )
+    for i, channel in enumerate(tg.channels):
+        txt.write(f"\n{channel} (mean {mean[i]:.4g}, std {std[i]:.4g}): ")
+        txt.runs(symbols[:, i])
+    return txt.getvalue()
+
+
+def features(tg, data):
+    rows = []
+    for name, values in stats(data).items():
+        rows.append((name, fmt_values(values, tg.rp)))
+    rows.append(
+        (
+            "zero-crossing rate (per sec)",
+            fmt_values(zero_crossing_rate(data, tg.sr), tg.rp),
+        )
+    )
+
+    peaks, energies, edges = spectrum(data, tg.sr)
+    peaks = fmt_values(peaks, tg.rp)
+    rows.append(
+        (
+            "dominant frequencies (Hz)",
+            ["/".join(peaks[:, i]) for i in range(len(tg.channels))],
+        )
+    )
+    for b in range(len(edges) - 1):
+        rows.append(
+            (
+                f"energy in {edges[b]:.4g}-{edges[b + 1]:.4g} Hz (%)",
+                fmt_values(100 * energies[b], tg.rp),
+            )
+        )
+
+    for name, values in physio_rates(data, tg.sr, tg.channels).items():
+        cells = ["-" if v is None else str(np.round(v, tg.rp)) for v in values]
+        rows.append((name, cells))
+
+    txt = TextWriter(tg.rp).write("Features of the sensor data:\n")
+    txt.write(f"| feature | {' | '.join(tg.channels)} |\n")
+    txt.write("|---" * (len(tg.channels) + 1) + "|")
+    for name, cells in rows:
+        txt.write(f"\n| {name} | {' | '.join(cells)} |")
+    return txt.getvalue()
+
+
+# text-only styles
+register(Visualization("quantized waveform", txt=quantized, listed=False))
+register(
+    Visualization(
+        "delta waveform",
+        txt=quantized,
+        txt_args={"deltas": True},
+        listed=False,
+    )
+)
+register(Visualization("symbolic waveform", txt=symbolic, listed=False))
+register(Visualization("features", txt=features, listed=False))
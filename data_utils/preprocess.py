@@ -2,6 +2,8 @@ import os
 import sys
 import fire
 
+from contextlib import nullcontext
+
 current_path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(current_path, ".."))
 
@@ -14,10 +16,31 @@ from data_utils.PTBXL_MI.ptbxl_mi_preprocessor import PTBXL_MI_Preprocessor
 from data_utils.PTBXL_STTC.ptbxl_sttc_preprocessor import PTBXL_STTC_Preprocessor
 from data_utils.sEMG_HG.sEMG_HG_preprocessor import sEMG_HG_Preprocessor
 from data_utils.WESAD.wesad_preprocessor import WESADPreprocessor
+from core.profiling import Profiler
+from core.tracing import span
+from core.feature_store import MODALITY_STEPS, store_derived
+
+# modality of the physiological datasets, for their derived features
+DATASET_MODALITIES = {
+    "WESAD": "RSP",
+    "sEMG_HG": "EMG",
+    "PTB-XL-CD": "ECG",
+    "PTB-XL-HYP": "ECG",
+    "PTB-XL-MI": "ECG",
+    "PTB-XL-STTC": "ECG",
+}
 
 
-def preprocess(dataset: str, data_dir: str, out_dir: str) -> None:
-    """Preprocess the dataset."""
+def preprocess(
+    dataset: str,
+    data_dir: str,
+    out_dir: str,
+    resample_method: str = "auto",
+    profile: bool = False,
+    derive: bool = False,
+    num_workers: int = None,
+) -> None:
+    """Preprocess the dataset, and derive the features of its windows if derive is set."""
     if dataset == "WESAD":
         task = "Emotion recognition"
         raw_data_path = data_dir
@@ -38,6 +61,7 @@ The data is collected over {win_len//sampling_rate} seconds. The data is normali
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "sEMG_HG":
@@ -71,6 +95,7 @@ The data is collected over {win_len//sampling_rate} seconds. The data is normali
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "PTB-XL-CD":
@@ -93,6 +118,7 @@ The ECG data is recorded over {win_len//sampling_rate} seconds. The data is norm
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "PTB-XL-HYP":
@@ -116,6 +142,7 @@ The ECG data is recorded over {win_len//sampling_rate} seconds. The data is norm
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "PTB-XL-MI":
@@ -139,6 +166,7 @@ The ECG data is recorded over {win_len//sampling_rate} seconds. The data is norm
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "PTB-XL-STTC":
@@ -161,6 +189,7 @@ The ECG data is recorded over {win_len//sampling_rate} seconds. The data is norm
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "HHAR":
@@ -185,6 +214,7 @@ The data is collected over {win_len//sampling_rate} seconds. The data is measure
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "Swimming":
@@ -197,10 +227,12 @@ The data is collected over {win_len//sampling_rate} seconds. The data is measure
         num_channels = 3
         classes = ["backstroke", "breaststroke", "butterfly", "freestyle", "stationary"]
         channels = ["X-axis", "Y-axis", "Z-axis"]
-        data_description = f"The sensor data is collected from an accelerometer measuring \
+        data_description = (
+            f"The sensor data is collected from an accelerometer measuring \
 acceleration along the x, y, and z axes. The data is normalized with the statistics of the user's data.\
 The data is collected over {win_len//sampling_rate} seconds. \
 The data is measured from a smartwatch which was attached to the wrist of a user."
+        )
         task_description = f"a task for classifying {len(classes)} swimming styles\
 , {', '.join(classes)}, using three-axis accelerometer data measured from a wrist-worn \
 smartwatch equipped by swimmers."
@@ -211,6 +243,7 @@ smartwatch equipped by swimmers."
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     elif dataset == "UTD-MHAD":
@@ -245,10 +278,12 @@ smartwatch equipped by swimmers."
             "Pickup and throw",
         ]
         channels = ["X-axis", "Y-axis", "Z-axis"]
-        data_description = f"The sensor data is collected from an accelerometer measuring \
+        data_description = (
+            f"The sensor data is collected from an accelerometer measuring \
 acceleration along the x, y, and z axes. The data is normalized with the statistics of the user's data.\
 The data is collected over {win_len//sampling_rate} seconds. \
 The data is measured from a smartwatch which was attached to the wrist of a user."
+        )
         task_description = f"a task for classifying {len(classes)} gestures\
 , {', '.join(classes)}, using three-axis accelerometer data measured from a wrist-worn smartwatch."
 
@@ -258,13 +293,30 @@ The data is measured from a smartwatch which was attached to the wrist of a user
             win_len=win_len,
             hop_len=hop_len,
             sampling_rate=sampling_rate,
+            resample_method=resample_method,
         )
 
     else:
         raise ValueError(f"Dataset {dataset} is not supported.")
 
-    preprocessor.preprocess()
-    preprocessor.store_data()
+    if profile:
+        profiler = Profiler(os.path.join(out_dir, dataset, "profile"))
+    else:
+        profiler = nullcontext()
+    with profiler:
+        with span("preprocess"):
+            preprocessor.preprocess()
+        with span("store_data"):
+            preprocessor.store_data()
+        if derive:
+            steps = MODALITY_STEPS.get(DATASET_MODALITIES.get(dataset), [])
+            for split in ["train", "val", "test"]:
+                store_derived(
+                    os.path.join(out_dir, dataset, "HF", split),
+                    sampling_rate,
+                    steps,
+                    num_workers,
+                )
     preprocessor.store_metadata(
         dataset=dataset,
         task=task,
@@ -3,17 +3,27 @@ import json
 import datasets
 import numpy as np
 
-from scipy.signal import resample
 from typing import Dict, Tuple
+from core.resample import Resampler
 
 
 class Preprocessor:
-    def __init__(self, raw_data_path, out_dir, win_len, hop_len, sampling_rate):
+    def __init__(
+        self,
+        raw_data_path,
+        out_dir,
+        win_len,
+        hop_len,
+        sampling_rate,
+        resample_method="auto",
+    ):
         self.raw_data_path = raw_data_path
         self.out_dir = out_dir
         self.win_len = win_len
         self.hop_len = hop_len
         self.sampling_rate = sampling_rate
+        # every window is resampled once, so there is nothing to cache
+        self.resampler = Resampler(resample_method, cache_size=0)
         self.data_dict = None
 
     def preprocess(self):
@@ -40,8 +50,7 @@ class Preprocessor:
         return new_data
 
     def resample_data(self, data: np.array, sr: int, target_sr: int) -> np.array:
-        resampled_size = int(data.shape[0] * target_sr / sr)
-        resampled_data = resample(data, resampled_size)
+        resampled_data = self.resampler(data, sr, target_sr)
 
         return resampled_data
 
@@ -1,4 +1,6 @@
+import os
 import json
+import hashlib
 import yaml
 import fire
 import torch
@@ -8,6 +10,7 @@ import threading
 import numpy as np
 
 from typing import List, Tuple, Any, Union
+from contextlib import nullcontext
 from multiprocessing import Process, Manager
 from sklearn.metrics import accuracy_score, f1_score
 
@@ -15,6 +18,15 @@ from core.logger import Logger
 from core.llm import LLM
 from core.vis_generator import VisualizationGenerator
 from core.solver import Solver
+from core.resample import get_resampler
+from core.tracing import tracer, span, set_sample, flush_spans, summarize
+from core.tracing import chrome_trace, fmt_summary
+from core.profiling import Profiler
+from core.retrieval import KNNIndex, load_features, index_path
+from core.feature_store import FeatureStore, derived_path
+from core.registry import dependency_cache
+
+EXAMPLE_POLICIES = ["random", "fixed", "pool", "knn"]
 
 
 def set_seed(seed: int) -> None:
@@ -44,6 +56,106 @@ def get_visualization(llm, task_metadata, examples, logger, results, lock):
         logger.print(f"visualization {vis['func']} selected")
 
 
+def sample_examples(ex_by_label: dict, config: dict) -> List[Tuple[np.array, str]]:
+    with span("example_sampling"):
+        examples = []
+        for _, ex_ds in ex_by_label.items():
+            examples += gen_examples(ex_ds, config["num_examples"])
+
+        if len(examples) != config["num_examples"] * (len(ex_by_label)):
+            examples = []
+            for _, ex_ds in ex_by_label.items():
+                examples += gen_examples(ex_ds, config["num_examples"])
+    return examples
+
+
+def retrieve_examples(
+    index: KNNIndex, ex_by_label: dict, data: np.array, config: dict
+) -> List[Tuple[np.array, str]]:
+    """The num_examples examples of each label nearest to the target"""
+    with span("example_retrieval"):
+        nearest = index.query(data, config["num_examples"])
+        examples = []
+        for label, ex_ds in ex_by_label.items():
+            for i in nearest[label]:
+                examples.append((np.array(ex_ds[i]["data"]), label))
+    return examples
+
+
+def example_set_id(examples: List[Tuple[np.array, str]]) -> str:
+    """Content hash of an example set, stable across runs and processes"""
+    h = hashlib.blake2b(digest_size=8)
+    for ex_data, ex_label in examples:
+        h.update(ex_label.encode("utf-8"))
+        h.update(np.ascontiguousarray(ex_data).tobytes())
+    return h.hexdigest()
+
+
+def example_sets(
+    ex_by_label: dict, config: dict, num_sets: int
+) -> List[Tuple[str, List[Tuple[np.array, str]]]]:
+    ex_sets = []
+    for _ in range(num_sets):
+        examples = sample_examples(ex_by_label, config)
+        ex_sets.append((example_set_id(examples), examples))
+    return ex_sets
+
+
+def sample_log_dir(pid: int, label: str) -> str:
+    label_txt = "_".join(label.split())
+    label_txt = "_".join(label_txt.split("/"))
+    label_txt = "_".join(label_txt.split("_"))
+    return f"prompts/{pid}_{label_txt}"
+
+
+def plan_visualization(
+    solver: Solver,
+    config: dict,
+    examples: List[Tuple[np.array, str]],
+    log_dir: str,
+    pid: int,
+    ex_by_label: dict,
+) -> bool:
+    """Plan and select the visualization if configured, returns whether it did"""
+    if not ((config["use_vis"] and config["vis_func"] is None) or config["plan_vis"]):
+        return False
+
+    top_k = config.get("vis_top_k")
+    score_examples = []
+    if top_k:
+        # a few more examples per class than in the prompts, for the local scores
+        num_examples = config.get("vis_score_examples", 5)
+        for ex_ds in ex_by_label.values():
+            score_examples += gen_examples(ex_ds, min(num_examples, len(ex_ds)))
+
+    # plan visualization using LLM
+    vg = VisualizationGenerator(
+        solver.llm,
+        solver.task_metadata,
+        solver.logger,
+        img_detail=config.get("sel_img_detail", "auto"),
+        img_size=config.get("img_size", 512),
+        plan_store_path=config.get("plan_store_path"),
+    )
+    vis_candidates = vg.plan(log_dir)
+    vis = vg.select(
+        vis_candidates,
+        examples,
+        log_dir,
+        score_examples,
+        top_k,
+        config.get("vis_min_separability", 0.5),
+    )
+
+    solver.logger.print(f"[{pid}] visualization {vis['func']} selected")
+    config["vis_func"] = vis["func"]
+    config["vis_args"] = vis["args"]
+    config["vis_knowledge"] = vis["knowledge"]
+    config["txt_style"] = vis["func"]
+    config["txt_args"] = vis["args"]
+    return True
+
+
 def solve(
     solver: Solver,
     data: dict,
@@ -52,46 +164,91 @@ def solve(
     results: List[Any],
     lock: threading.Lock,
     pid: int,
+    index: KNNIndex = None,
 ) -> None:
     set_seed(config["seed"] + pid)
+    set_sample(pid)
+
+    if index is not None:
+        examples = retrieve_examples(index, ex_by_label, data["data"], config)
+    else:
+        examples = sample_examples(ex_by_label, config)
+    log_dir = sample_log_dir(pid, data["label"])
+    reset_vis_func = plan_visualization(
+        solver, config, examples, log_dir, pid, ex_by_label
+    )
 
-    examples = []
-    for _, ex_ds in ex_by_label.items():
-        examples += gen_examples(ex_ds, config["num_examples"])
+    with span("solving"):
+        answer = solver.solve(np.array(data["data"]), examples, log_dir)
 
-    if len(examples) != config["num_examples"] * (len(ex_by_label)):
-        examples = []
-        for _, ex_ds in ex_by_label.items():
-            examples += gen_examples(ex_ds, config["num_examples"])
+    if reset_vis_func:
+        config["vis_func"] = None
 
-    label_txt = "_".join(data["label"].split())
-    label_txt = "_".join(label_txt.split("/"))
-    label_txt = "_".join(label_txt.split("_"))
-    log_dir = f"prompts/{pid}_{label_txt}"
+    with lock:
+        results.append((pid, data["label"], answer))
+        solver.logger.print(f"[{pid}] GT: {data['label']}, Pred: {answer}")
+    flush_spans(solver.logger)
+    # child processes exit without running atexit handlers
+    solver.logger.flush()
 
-    # plan visualization using LLM
-    reset_vis_func = False
-    if (config["use_vis"] and config["vis_func"] is None) or config["plan_vis"]:
-        reset_vis_func = True
-        vg = VisualizationGenerator(solver.llm, solver.task_metadata, solver.logger)
-        vis_candidates = vg.plan(log_dir)
-        vis = vg.select(vis_candidates, examples, log_dir)
-
-        solver.logger.print(f"[{pid}] visualization {vis['func']} selected")
-        config["vis_func"] = vis["func"]
-        config["vis_args"] = vis["args"]
-        config["vis_knowledge"] = vis["knowledge"]
-        config["txt_style"] = vis["func"]
-        config["txt_args"] = vis["args"]
-
-    answer = solver.solve(np.array(data["data"]), examples, log_dir)
+
+def solve_group(
+    solver: Solver,
+    group: List[Tuple[int, dict]],
+    ex_by_label: dict,
+    config: dict,
+    results: List[Any],
+    lock: threading.Lock,
+    examples: List[Tuple[np.array, str]] = None,
+) -> None:
+    """Solve (pid, data) targets sharing one set of examples with Solver.solve_many"""
+    pids = [pid for pid, _ in group]
+    set_seed(config["seed"] + pids[0])
+    set_sample(pids[0])
+
+    if examples is None:
+        examples = sample_examples(ex_by_label, config)
+    log_dirs = [sample_log_dir(pid, data["label"]) for pid, data in group]
+    reset_vis_func = plan_visualization(
+        solver, config, examples, log_dirs[0], pids[0], ex_by_label
+    )
+
+    with span("solving"):
+        answers = solver.solve_many(
+            [np.array(data["data"]) for _, data in group],
+            examples,
+            log_dirs,
+            sample_ids=pids,
+        )
 
     if reset_vis_func:
         config["vis_func"] = None
 
     with lock:
-        results.append((pid, data["label"], answer))
-        solver.logger.print(f"[{pid}] GT: {data['label']}, Pred: {answer}")
+        for (pid, data), answer in zip(group, answers):
+            results.append((pid, data["label"], answer))
+            solver.logger.print(f"[{pid}] GT: {data['label']}, Pred: {answer}")
+    flush_spans(solver.logger)
+    solver.logger.flush()
+
+
+def solve_groups(
+    solver: Solver,
+    groups: List[Tuple[List[Tuple[int, dict]], List[Tuple[np.array, str]]]],
+    ex_by_label: dict,
+    config: dict,
+    results: List[Any],
+    lock: threading.Lock,
+) -> None:
+    """Solve (group, examples) pairs one after the other with solve_group"""
+    for group, examples in groups:
+        solve_group(solver, group, ex_by_label, config, results, lock, examples)
+
+
+def chunks(items: List, num_chunks: int) -> List[List]:
+    """Split items into at most num_chunks interleaved chunks"""
+    num_chunks = max(min(num_chunks, len(items)), 1)
+    return [items[c::num_chunks] for c in range(num_chunks)]
 
 
 def report(results: List[Any], logger: Logger) -> None:
@@ -111,13 +268,87 @@ def report(results: List[Any], logger: Logger) -> None:
     logger.store("predictions.txt", result_str)
 
 
+def report_trace(logger: Logger, export_chrome_trace: bool = False) -> None:
+    spans = [s for sample_spans in logger.events("spans") for s in sample_spans]
+    summary = summarize(spans)
+    logger.print(fmt_summary(summary))
+    logger.store("trace_summary.json", json.dumps(summary, indent=2))
+    if export_chrome_trace:
+        logger.store("trace.json", json.dumps(chrome_trace(spans)))
+
+
+def report_cascade(logger: Logger) -> None:
+    records = logger.events("cascade")
+    stages = {}
+    for record in records:
+        for i, stage in enumerate(record["stages"]):
+            stats = stages.setdefault(
+                stage["stage"],
+                {"samples": 0, "escalated": 0, "tokens": [], "latency": []},
+            )
+            stats["samples"] += 1
+            stats["escalated"] += i < len(record["stages"]) - 1
+            stats["tokens"].append(stage["tokens"])
+            stats["latency"].append(stage["latency"])
+
+    summary = {"samples": len(records), "stages": {}}
+    for k, stats in sorted(stages.items()):
+        summary["stages"][k] = {
+            "samples": stats["samples"],
+            "escalation_rate": stats["escalated"] / stats["samples"],
+            "mean_tokens": float(np.mean(stats["tokens"])),
+            "mean_latency": float(np.mean(stats["latency"])),
+        }
+        logger.print(
+            f"Cascade stage {k}: {stats['samples']} samples, "
+            f"{summary['stages'][k]['escalation_rate']:.0%} escalated, "
+            f"{summary['stages'][k]['mean_tokens']:.0f} tokens, "
+            f"{summary['stages'][k]['mean_latency']:.2f}s"
+        )
+    if records:
+        summary["tokens_per_sample"] = float(
+            np.mean([sum(s["tokens"] for s in r["stages"]) for r in records])
+        )
+        summary["latency_per_sample"] = float(
+            np.mean([sum(s["latency"] for s in r["stages"]) for r in records])
+        )
+        logger.print(
+            f"Cascade: {summary['tokens_per_sample']:.0f} tokens and "
+            f"{summary['latency_per_sample']:.2f}s per sample"
+        )
+    logger.store("cascade_summary.json", json.dumps(summary, indent=2))
+
+
+def report_usage(logger: Logger) -> None:
+    usages = logger.events("usage")
+    if not usages:
+        return
+    prompt_tokens = sum(usage["prompt_tokens"] for usage in usages)
+    cached_tokens = sum(usage["cached_tokens"] for usage in usages)
+    logger.print(
+        f"Prompt tokens: {prompt_tokens} in {len(usages)} requests, "
+        f"{cached_tokens} cached ({cached_tokens / max(prompt_tokens, 1):.0%})"
+    )
+    summary = {
+        "requests": len(usages),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "completion_tokens": sum(usage["completion_tokens"] for usage in usages),
+    }
+    logger.store("usage_summary.json", json.dumps(summary, indent=2))
+
+
 def run(config: str) -> None:
     with open(config, "r", encoding="utf-8") as config_file:
         config = yaml.safe_load(config_file)
 
     set_seed(config["seed"])
 
-    logger = Logger(config["log_dir"])
+    logger = Logger(
+        config["log_dir"],
+        async_io=config.get("async_log", False),
+        backend=config.get("log_backend", "files"),
+    )
     logger.log_config(config)
 
     llm = LLM(
@@ -136,7 +367,28 @@ def run(config: str) -> None:
         task_metadata = json.load(f)
     logger.print("Loaded target data")
 
+    store = None
+    store_path = derived_path(config["target_data_dir"])
+    if config.get("derived_features", True) and os.path.exists(store_path):
+        store = FeatureStore(store_path)
+        if store.matches(task_metadata["sampling_rate"], len(ds)):
+            # processes started below share the store through the cache
+            dependency_cache.store = store
+            logger.print("Loaded derived features")
+        else:
+            logger.print(f"Ignoring outdated derived features in {store_path}")
+            store = None
+
     solver = Solver(llm, config, task_metadata, logger)
+    if not config["use_vis"]:
+        resampler = get_resampler(config.get("resample_method", "auto"))
+        logger.print(
+            resampler.describe(
+                len(ds[0]["data"]),
+                task_metadata["sampling_rate"],
+                config["txt_sampling_rate"],
+            )
+        )
 
     manager = Manager()
     results = manager.list()
@@ -144,9 +396,19 @@ def run(config: str) -> None:
     processes = []
     pid = 0
 
+    profile = config.get("profile", False)
+    if profile:
+        # a few samples solved in this process and thread, so that the
+        # profilers (which only instrument the calling thread) see them
+        num_samples = config.get("profile_samples", 4) // len(ds_by_label)
+        config["num_samples"] = min(config["num_samples"], max(num_samples, 1))
+        config["multiprocessing"] = False
+        config["max_concurrency"] = 1
+
     # for each label in the target dataset filter samples
     tg_by_label = {}
     ex_by_label = {}
+    ex_idcs_by_label = {}
     for label in ds.unique("label"):
         len_ds = len(ds_by_label[label])
         tg_idcs = np.random.choice(len_ds, config["num_samples"], replace=False)
@@ -156,30 +418,129 @@ def run(config: str) -> None:
         ex_idcs = [i for i in range(len_ds) if i not in tg_idcs]
         ex_ds = ds_by_label[label].select(ex_idcs)
         ex_by_label[label] = ex_ds
+        ex_idcs_by_label[label] = ex_idcs
 
+    tracer.enable(config.get("trace", False))
     logger.print("Solving tasks...")
+    if profile:
+        # the spans are summarized with the trace in trace_summary.json
+        profiler = Profiler(os.path.join(config["log_dir"], "profile"), stages=False)
+    else:
+        profiler = nullcontext()
+    jobs = []
     for label in ds.unique("label"):
         for data in tg_by_label[label]:
             pid += 1
+            jobs.append((pid, data))
+
+    policy = config.get("example_policy", "random")
+    if policy not in EXAMPLE_POLICIES:
+        raise ValueError(f"Unsupported example policy: {policy}")
+    cached_layout = config.get("prompt_layout", "default") == "cached"
+    if policy == "random" and cached_layout:
+        # the cached layout needs examples shared across samples
+        policy = "fixed"
+
+    index = None
+    if policy == "knn":
+        # features of all windows are stored next to the dataset, targets are
+        # left out of the index
+        features = load_features(
+            {label: np.array(ds_by_label[label]["data"]) for label in ex_by_label},
+            task_metadata["sampling_rate"],
+            index_path(config["target_data_dir"]),
+        )
+        index = KNNIndex(
+            {label: features[label][ex_idcs_by_label[label]] for label in ex_by_label},
+            task_metadata["sampling_rate"],
+        )
+
+    ex_sets = []
+    if policy in ["fixed", "pool"]:
+        num_sets = 1 if policy == "fixed" else config.get("example_pool_size", 4)
+        ex_sets = example_sets(ex_by_label, config, num_sets)
+        logger.store(
+            "example_sets.json",
+            json.dumps(
+                {
+                    set_id: {
+                        "labels": [ex_label for _, ex_label in examples],
+                        "samples": [pid for pid, _ in jobs[k :: len(ex_sets)]],
+                    }
+                    for k, (set_id, examples) in enumerate(ex_sets)
+                },
+                indent=2,
+            ),
+        )
+    if cached_layout and store is not None:
+        # one y-range for all samples, so that prompts share a prefix
+        solver.ylim = store.ylim()
+    elif cached_layout:
+        # one y-range for all samples, so that prompts share a prefix
+        windows = [ex_data for _, examples in ex_sets for ex_data, _ in examples]
+        if index is not None:
+            windows += [np.array(ex_ds["data"]) for ex_ds in ex_by_label.values()]
+        windows += [np.array(data["data"]) for _, data in jobs]
+        solver.ylim = (
+            min(window.min() for window in windows),
+            max(window.max() for window in windows),
+        )
+
+    pack_size = config.get("pack_size", 1)
+    # groups are dealt over about num_process processes
+    num_chunks = config["num_process"] if config["multiprocessing"] else 1
+    if ex_sets:
+        # sets are assigned round-robin, and the targets sharing a set are split
+        # into chunks that are solved together, so that each prepares the set once
+        per_set = max(num_chunks // len(ex_sets), 1)
+        groups = [
+            (chunk, examples)
+            for k, (_, examples) in enumerate(ex_sets)
+            for chunk in chunks(jobs[k :: len(ex_sets)], per_set)
+            if chunk
+        ]
+    elif pack_size > 1 and index is None:
+        # groups take every num_groups-th target, so that their labels are mixed
+        num_groups = -(-len(jobs) // pack_size)
+        groups = [(jobs[g::num_groups], None) for g in range(num_groups)]
+    else:
+        groups = []
+
+    if groups:
+        tasks = [
+            (solve_groups, (solver, chunk, ex_by_label, config, results, lock))
+            for chunk in chunks(groups, num_chunks)
+        ]
+    else:
+        tasks = [
+            (solve, (solver, data, ex_by_label, config, results, lock, pid, index))
+            for pid, data in jobs
+        ]
+
+    with profiler:
+        for i, (target, args) in enumerate(tasks, 1):
             if config["multiprocessing"]:
-                p = Process(
-                    target=solve,
-                    args=(solver, data, ex_by_label, config, results, lock, pid),
-                )
+                p = Process(target=target, args=args)
                 p.start()
                 processes.append(p)
 
-                if pid % config["num_process"] == 0:
+                if i % config["num_process"] == 0:
                     for p in processes:
                         p.join()
                     processes = []
             else:
-                solve(solver, data, ex_by_label, config, results, lock, pid)
+                target(*args)
 
-    for p in processes:
-        p.join()
+        for p in processes:
+            p.join()
 
     report(results, logger)
+    report_usage(logger)
+    if config.get("cascade", False):
+        report_cascade(logger)
+    if config.get("trace", False) or profile:
+        report_trace(logger, config.get("chrome_trace", False))
+    logger.close()
 
 
 if __name__ == "__main__":
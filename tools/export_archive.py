@@ -0,0 +1,55 @@
+import os
+import sys
+import fire
+
+current_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(current_path, ".."))
+
+from core.archive import ArchiveReader
+from core.logger import FileSink
+
+
+def export(archive: str, out_dir: str, sample: str = "", list_samples: bool = False):
+    """Export a run archive (or one of its samples) to the per-file log layout"""
+    reader = ArchiveReader(archive)
+    if list_samples:
+        for name in reader.samples():
+            print(name)
+        reader.close()
+        return
+
+    # sample is a pid or a directory under prompts/, e.g. 12 or prompts/12_walk
+    prefix = sample
+    if sample and not str(sample).startswith("prompts/"):
+        matches = [
+            name
+            for name in reader.samples()
+            if name.split("/")[1].split("_")[0] == str(sample)
+        ]
+        if not matches:
+            raise ValueError(f"Sample {sample} is not in the archive.")
+        prefix = matches[0]
+
+    sink = FileSink(out_dir)
+    num_files = 0
+    for filename, content in reader.files(prefix):
+        sink.write(filename, content)
+        num_files += 1
+    for chat in reader.chats(prefix):
+        sink.store_chat(
+            chat["filename"],
+            chat["prompt"],
+            chat["answer"],
+            chat["num_tokens"],
+            cost=chat["cost"],
+        )
+        num_files += 1
+    if not sample:
+        for kind, pid, payload in reader.events():
+            sink.store_event(kind, payload, pid)
+    reader.close()
+    print(f"Exported {num_files} files to {out_dir}")
+
+
+if __name__ == "__main__":
+    fire.Fire(export)